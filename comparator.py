@@ -1,10 +1,173 @@
 import difflib
+import hashlib
 import html
+import logging
 import re
 import string
-from typing import List, Dict, Tuple, Optional
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from io import StringIO
+from itertools import zip_longest
+from typing import List, Dict, Tuple, Optional, Iterable
 from utils import extract_text_from_file
 
+try:
+    from cdifflib import CSequenceMatcher as _SequenceMatcher
+except ImportError:
+    _SequenceMatcher = difflib.SequenceMatcher
+
+logger = logging.getLogger(__name__)
+
+_WORD_AUTOJUNK_THRESHOLD = 50_000
+_WORD_SENTENCE_SPLIT_LIMIT = 5000
+# Word diffs of modified line pairs, shared by every comparison in the process. Keyed by a digest of the pair
+# and bounded both in entries and in the total length of the stored HTML.
+_WORD_DIFF_CACHE_MAX_ENTRIES = 10_000
+_WORD_DIFF_CACHE_MAX_CHARS = 16 * 1024 * 1024
+_word_diff_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_word_diff_cache_chars = 0
+_word_diff_cache_lock = threading.Lock()
+
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=\.) ')
+_URL_RE = re.compile(r"((?:https?://|ftp://|www\.)[^\s/$.?#].[^\s]*)")
+_HYPHEN_RE = re.compile(r'-\s*\n\s*')
+_PUNCT_TRANSLATOR = str.maketrans('', '', string.punctuation)
+_HTML_SPECIALS_RE = re.compile(r'[&<>"\']')
+_URL_HINT_RE = re.compile(r'https?://|ftp://|www\.')
+
+_EQ_PRE = "<span class='diff-line diff-equal'><span class='diff-marker'> </span>"
+_ADD_PRE = "<span class='diff-line diff-added'><span class='diff-marker'>+</span>"
+_DEL_PRE = "<span class='diff-line diff-deleted'><span class='diff-marker'>-</span>"
+_MOD_PRE = "<span class='diff-line diff-modified'><span class='diff-marker'>*</span>"
+_LINE_END = "</span>\n"
+
+def _clean_line(text: str) -> str:
+    return ' '.join(text.split())
+
+def _clean_line_ignore_case(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+def _clean_line_ignore_punctuation(text: str) -> str:
+    return ' '.join(text.translate(_PUNCT_TRANSLATOR).split())
+
+def _clean_line_ignore_case_punctuation(text: str) -> str:
+    return ' '.join(text.lower().translate(_PUNCT_TRANSLATOR).split())
+
+def _url_to_anchor(match: re.Match) -> str:
+    """Builds the anchor tag for a URL matched in already-escaped text."""
+    url = match.group(1)
+    href = f'http://{url}' if url.startswith('www.') else url
+    return f'<a href="{href}" target="_blank" title="Open link: {href}">{url}</a>'
+
+def _format_links(line: str) -> str:
+    """Escapes a raw line and wraps any URLs in anchor tags."""
+    return _URL_RE.sub(_url_to_anchor, html.escape(line))
+
+@lru_cache(maxsize=8192)
+def _render_line_cached(line: str) -> str:
+    """Escapes a line and formats its links, skipping the work for plain lines."""
+    if not _HTML_SPECIALS_RE.search(line) and not _URL_HINT_RE.search(line):
+        return line
+    return _format_links(line)
+
+def _render_lines(lines: List[str]) -> Iterable[str]:
+    """Renders a block of lines, scanning the joined block once before falling back per line."""
+    block = '\n'.join(lines)
+    if not _HTML_SPECIALS_RE.search(block) and not _URL_HINT_RE.search(block):
+        return lines
+    return map(_render_line_cached, lines)
+
+def _generate_word_diff_html(line1: str, line2: str, split_sentences: bool = True) -> str:
+    """
+    Generates HTML for word-level diff between two lines.
+    Lines are whitespace-normalized by preprocessing, so words are split on single spaces.
+    Very long lines are aligned sentence by sentence first when split_sentences is True.
+    """
+    if line1 == line2:
+        return html.escape(line2)
+
+    words1 = line1.split(' ')
+    words2 = line2.split(' ')
+
+    if set(words1).isdisjoint(words2):
+        return f"<span class='word-deleted'>{html.escape(line1)}</span><span class='word-added'>{html.escape(line2)}</span>"
+
+    if split_sentences and max(len(words1), len(words2)) > _WORD_SENTENCE_SPLIT_LIMIT:
+        sentences1 = _SENTENCE_SPLIT_RE.split(line1)
+        sentences2 = _SENTENCE_SPLIT_RE.split(line2)
+        if len(sentences1) > 1 and len(sentences2) > 1:
+            return _generate_sentence_diff_html(sentences1, sentences2)
+
+    use_autojunk = len(words1) * len(words2) > _WORD_AUTOJUNK_THRESHOLD
+    matcher = _SequenceMatcher(None, words1, words2, autojunk=use_autojunk)
+    html_out = []
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        # Only escape the side(s) each opcode actually emits.
+        if tag == 'equal':
+            html_out.append(html.escape(' '.join(words2[j1:j2])))
+
+        elif tag == 'delete':
+            html_out.append(f"<span class='word-deleted'>{html.escape(' '.join(words1[i1:i2]))}</span>")
+
+        elif tag == 'insert':
+            html_out.append(f"<span class='word-added'>{html.escape(' '.join(words2[j1:j2]))}</span>")
+
+        elif tag == 'replace':
+            escaped1 = html.escape(' '.join(words1[i1:i2]))
+            escaped2 = html.escape(' '.join(words2[j1:j2]))
+            html_out.append(f"<span class='word-deleted'>{escaped1}</span><span class='word-added'>{escaped2}</span>")
+
+    return " ".join(html_out)
+
+def _generate_sentence_diff_html(sentences1: List[str], sentences2: List[str]) -> str:
+    """Aligns two long lines by sentence, then word-diffs only the replaced sentence pairs."""
+    matcher = _SequenceMatcher(None, sentences1, sentences2, autojunk=False)
+    html_out = []
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            html_out.append(html.escape(' '.join(sentences2[j1:j2])))
+
+        elif tag == 'delete':
+            html_out.append(f"<span class='word-deleted'>{html.escape(' '.join(sentences1[i1:i2]))}</span>")
+
+        elif tag == 'insert':
+            html_out.append(f"<span class='word-added'>{html.escape(' '.join(sentences2[j1:j2]))}</span>")
+
+        elif tag == 'replace':
+            for sentence1, sentence2 in zip_longest(sentences1[i1:i2], sentences2[j1:j2], fillvalue=""):
+                if sentence1 and sentence2:
+                    html_out.append(_generate_word_diff_html(sentence1, sentence2, split_sentences=False))
+                elif sentence2:
+                    html_out.append(f"<span class='word-added'>{html.escape(sentence2)}</span>")
+                elif sentence1:
+                    html_out.append(f"<span class='word-deleted'>{html.escape(sentence1)}</span>")
+
+    return " ".join(html_out)
+
+def _word_diff_html_cached(line1: str, line2: str) -> str:
+    """Word diff of a modified line pair, kept across comparisons so re-runs with new options reuse it."""
+    global _word_diff_cache_chars
+    key = hashlib.blake2b(f"{len(line1)}:{line1}{line2}".encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _word_diff_cache_lock:
+        cached = _word_diff_cache.get(key)
+        if cached is not None:
+            _word_diff_cache.move_to_end(key)
+            return cached
+
+    diff_html = _generate_word_diff_html(line1, line2)
+    if len(diff_html) > _WORD_DIFF_CACHE_MAX_CHARS:
+        return diff_html
+    with _word_diff_cache_lock:
+        if key not in _word_diff_cache:
+            _word_diff_cache[key] = diff_html
+            _word_diff_cache_chars += len(diff_html)
+            while len(_word_diff_cache) > _WORD_DIFF_CACHE_MAX_ENTRIES or _word_diff_cache_chars > _WORD_DIFF_CACHE_MAX_CHARS:
+                _word_diff_cache_chars -= len(_word_diff_cache.popitem(last=False)[1])
+    return diff_html
+
 class PDFComparator:
     """
     Performs basic comparison using difflib, enhanced with preprocessing options
@@ -30,6 +193,16 @@ class PDFComparator:
         self.ignore_punctuation = ignore_punctuation
         self.de_hyphenate = de_hyphenate
 
+        # Options are fixed for the comparator's lifetime, so pick the line cleaner once.
+        if ignore_case and ignore_punctuation:
+            self._preprocess_line = _clean_line_ignore_case_punctuation
+        elif ignore_case:
+            self._preprocess_line = _clean_line_ignore_case
+        elif ignore_punctuation:
+            self._preprocess_line = _clean_line_ignore_punctuation
+        else:
+            self._preprocess_line = _clean_line
+
         self.success: bool = False
         self.error_message: Optional[str] = None
         self.is_identical: bool = False
@@ -41,16 +214,6 @@ class PDFComparator:
         self.diff_html: Optional[str] = None
         self.summary: Dict[str, int] = {"lines_added": 0, "lines_deleted": 0, "lines_modified": 0}
 
-    def _apply_preprocessing_options(self, text: str) -> str:
-        """Applies selected preprocessing options to a text string."""
-        if self.ignore_case:
-            text = text.lower()
-        if self.ignore_punctuation:
-            translator = str.maketrans('', '', string.punctuation)
-            text = text.translate(translator)
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text
-
     def _preprocess_text(self, raw_text: Optional[str]) -> Optional[List[str]]:
         """
         Preprocesses raw text into a list of cleaned lines, applying options.
@@ -60,128 +223,66 @@ class PDFComparator:
 
         processed_text = raw_text
 
-        if self.de_hyphenate:
-            processed_text = re.sub(r'-\s*\n\s*', '', processed_text)
+        if self.de_hyphenate and '-' in processed_text and '\n' in processed_text:
+            processed_text = _HYPHEN_RE.sub('', processed_text)
 
         lines = processed_text.splitlines()
 
-        processed_lines = []
-        for line in lines:
-            processed_line = self._apply_preprocessing_options(line)
-            if processed_line:
-                processed_lines.append(processed_line)
+        processed_lines = [processed_line for processed_line in map(self._preprocess_line, lines) if processed_line]
 
         return processed_lines
 
-    @staticmethod
-    def _generate_word_diff_html(line1: str, line2: str) -> str:
-        """Generates HTML for word-level diff between two lines."""
-        words1 = re.split(r'(\s+)', line1); words1 = [w for w in words1 if w]
-        words2 = re.split(r'(\s+)', line2); words2 = [w for w in words2 if w]
-
-        matcher = difflib.SequenceMatcher(None, words1, words2, autojunk=False)
-        html_out = []
-
-        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-            seg1 = "".join(words1[i1:i2])
-            seg2 = "".join(words2[j1:j2])
-            escaped1 = html.escape(seg1)
-            escaped2 = html.escape(seg2)
-
-            if tag == 'equal':
-                html_out.append(escaped2)
-
-            elif tag == 'delete':
-                html_out.append(f"<span class='word-deleted'>{escaped1}</span>")
-
-            elif tag == 'insert':
-                html_out.append(f"<span class='word-added'>{escaped2}</span>")
-
-            elif tag == 'replace':
-                if escaped1.strip():
-                     html_out.append(f"<span class='word-deleted'>{escaped1}</span>")
-
-                if escaped2.strip():
-                     html_out.append(f"<span class='word-added'>{escaped2}</span>")
-
-        return "".join(filter(None, html_out))
-
-    @staticmethod
-    def _format_links(line: str) -> str:
-        url_pattern = re.compile(r"((?:https?://|ftp://|www\.)[^\s/$.?#].[^\s]*)")
-        parts: List[str] = []; last_end = 0
-        for match in url_pattern.finditer(line):
-            start, end = match.span()
-            parts.append(html.escape(line[last_end:start]))
-            url = match.group(1); href = url
-            if url.startswith('www.') and not url.startswith(('http://', 'https://', 'ftp://')):
-                href = f'http://{url}'
-
-            safe_href = html.escape(href); safe_url_display = html.escape(url)
-            parts.append(f'<a href="{safe_href}" target="_blank" title="Open link: {safe_href}">{safe_url_display}</a>')
-            last_end = end
-
-        parts.append(html.escape(line[last_end:]))
-        return "".join(parts)
-
     def _generate_diff_html_with_word_level(self, text1_lines: List[str], text2_lines: List[str]) -> str:
         """Generates HTML diff, using word-level diff for replaced lines."""
-        d = difflib.SequenceMatcher(None, text1_lines, text2_lines, autojunk=False)
-        html_out: List[str] = []
+        line_ids: Dict[str, int] = {}
+        intern_line = lambda line: line_ids.setdefault(line, len(line_ids))
+        ids1 = list(map(intern_line, text1_lines))
+        ids2 = list(map(intern_line, text2_lines))
+        d = _SequenceMatcher(None, ids1, ids2, autojunk=False)
+        buf = StringIO()
+        write = buf.write
+        _render = _render_line_cached
+        _render_block = _render_lines
+        _word_diff = _word_diff_html_cached
         lines_added = 0
         lines_deleted = 0
         lines_modified = 0
 
         for opcode, i1, i2, j1, j2 in d.get_opcodes():
             if opcode == 'equal':
-                for line in text1_lines[i1:i2]:
-                    escaped_line = html.escape(line)
-                    linked_line = self._format_links(escaped_line)
-                    html_out.append(f"<span class='diff-line diff-equal'><span class='diff-marker'> </span>{linked_line}</span>")
+                for line in _render_block(text1_lines[i1:i2]):
+                    write(_EQ_PRE); write(line); write(_LINE_END)
             elif opcode == 'insert':
-                for line in text2_lines[j1:j2]:
-                    escaped_line = html.escape(line)
-                    linked_line = self._format_links(escaped_line)
-                    html_out.append(f"<span class='diff-line diff-added'><span class='diff-marker'>+</span>{linked_line}</span>")
-                    lines_added += 1
+                for line in _render_block(text2_lines[j1:j2]):
+                    write(_ADD_PRE); write(line); write(_LINE_END)
+                lines_added += j2 - j1
             elif opcode == 'delete':
-                for line in text1_lines[i1:i2]:
-                    escaped_line = html.escape(line)
-                    linked_line = self._format_links(escaped_line)
-                    html_out.append(f"<span class='diff-line diff-deleted'><span class='diff-marker'>-</span>{linked_line}</span>")
-                    lines_deleted += 1
+                for line in _render_block(text1_lines[i1:i2]):
+                    write(_DEL_PRE); write(line); write(_LINE_END)
+                lines_deleted += i2 - i1
             elif opcode == 'replace':
-                len1 = i2 - i1
-                len2 = j2 - j1
-                lines_modified += max(len1, len2)
-
-                max_len = max(len1, len2)
-                for i in range(max_len):
-                    line1 = text1_lines[i1 + i] if i < len1 else ""
-                    line2 = text2_lines[j1 + i] if i < len2 else ""
+                lines_modified += max(i2 - i1, j2 - j1)
 
+                for line1, line2 in zip_longest(text1_lines[i1:i2], text2_lines[j1:j2], fillvalue=""):
                     if line1 and line2:
-                        word_diff_content = self._generate_word_diff_html(line1, line2)
-
-                        html_out.append(f"<span class='diff-line diff-modified'><span class='diff-marker'>*</span>{word_diff_content}</span>")
+                        write(_MOD_PRE); write(_word_diff(line1, line2)); write(_LINE_END)
 
                     elif line2:
-                        escaped_line = html.escape(line2)
-                        linked_line = self._format_links(escaped_line)
-                        html_out.append(f"<span class='diff-line diff-added'><span class='diff-marker'>+</span>{linked_line}</span>")
+                        write(_ADD_PRE); write(_render(line2)); write(_LINE_END)
 
                     elif line1:
-                        escaped_line = html.escape(line1)
-                        linked_line = self._format_links(escaped_line)
-                        html_out.append(f"<span class='diff-line diff-deleted'><span class='diff-marker'>-</span>{linked_line}</span>")
+                        write(_DEL_PRE); write(_render(line1)); write(_LINE_END)
 
         self.summary = {"lines_added": lines_added, "lines_deleted": lines_deleted, "lines_modified": lines_modified}
-        print(f"DEBUG comparator.py: Calculated summary: {self.summary}")
-        return "\n".join(html_out)
+        logger.debug("Calculated summary: %s", self.summary)
+        if buf.tell():
+            buf.truncate(buf.tell() - 1)
+        return buf.getvalue()
 
     def compare(self) -> bool:
         """Compares files using configured options, returns True if process completed."""
-        print(f"Starting Basic Comparison Process... Options: Case={self.ignore_case}, Punctuation={self.ignore_punctuation}, Dehyphenate={self.de_hyphenate}")
+        logger.debug("Starting Basic Comparison Process... Options: Case=%s, Punctuation=%s, Dehyphenate=%s",
+                     self.ignore_case, self.ignore_punctuation, self.de_hyphenate)
         self.success = False; self.error_message = None; self.is_identical = False
         self.is_identical_raw = False; self.diff_html = None
         self.summary = {"lines_added": 0, "lines_deleted": 0, "lines_modified": 0}
@@ -203,12 +304,11 @@ class PDFComparator:
                  self.error_message = "Text extraction failed unexpectedly."
                  return False
 
-            raw_check_possible = not (self.ignore_case or self.ignore_punctuation or self.de_hyphenate)
-            if raw_check_possible and self.text1_raw == self.text2_raw:
+            if self.text1_raw is self.text2_raw or self.text1_raw == self.text2_raw:
                 self.is_identical_raw = True
                 self.is_identical = True
                 self.success = True
-                print("Basic compare: Files identical raw (no options enabled).")
+                logger.debug("Basic compare: Files identical raw.")
                 return True
 
             self.text1_processed_lines = self._preprocess_text(self.text1_raw)
@@ -220,22 +320,19 @@ class PDFComparator:
             if self.text1_processed_lines == self.text2_processed_lines:
                 self.is_identical = True
                 self.success = True
-                self.is_identical_raw = raw_check_possible and self.is_identical_raw
-                print("Basic compare: Files identical after preprocessing.")
+                logger.debug("Basic compare: Files identical after preprocessing.")
                 return True
 
-            if self.is_identical_raw and not self.is_identical:
-                 print("Warning: Raw text was identical, but processed text differs.")
-
             self.diff_html = self._generate_diff_html_with_word_level(
                 self.text1_processed_lines, self.text2_processed_lines
             )
+            _render_line_cached.cache_clear()
             self.success = True
-            print("Basic compare: Differences found and diff generated.")
+            logger.debug("Basic compare: Differences found and diff generated.")
             return True
 
         except Exception as e:
              self.error_message = f"Unexpected error during basic comparison: {e}"
              self.success = False
-             print(f"ERROR in basic compare: {e}")
+             logger.error("ERROR in basic compare: %s", e)
              return True
\ No newline at end of file
@@ -1,23 +1,162 @@
+import asyncio
+import codecs
+from collections import OrderedDict, deque
+import os
+import random
+import threading
 import time
 import json
 import html
 import re
 import difflib
-from groq import Groq, RateLimitError, APIError, BadRequestError
-from typing import List, Dict, Tuple, Optional, Any
+import hashlib
+from functools import lru_cache
+from itertools import groupby
+from groq import Groq, AsyncGroq, RateLimitError, APIConnectionError, APIError, BadRequestError
+from typing import List, Dict, Deque, Tuple, Optional, Any
 from utils import extract_text_from_file
 
 try:
     import tiktoken
     tiktoken_found = True
-    try:
-        tokenizer = tiktoken.get_encoding("cl100k_base")
-    except Exception as e:
-        print(f"Warning: Could not initialize Tiktoken tokenizer: {e}")
-        tiktoken_found = False
 except ImportError:
     tiktoken_found = False
-    tokenizer = None
+
+DEFAULT_TOKENIZER_NAME = "cl100k_base"
+
+
+@lru_cache(maxsize=4)
+def _get_tokenizer(name: str = DEFAULT_TOKENIZER_NAME):
+    """Loads a Tiktoken encoding once per process; the BPE table load is slow."""
+    return tiktoken.get_encoding(name)
+
+try:
+    from rapidfuzz.distance import Levenshtein as _RapidfuzzLevenshtein
+except ImportError:
+    _RapidfuzzLevenshtein = None
+
+try:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so the existing handlers still apply.
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+_PARA_RE = re.compile(r'\n\s*\n')
+_SENT_RE = re.compile(r'(?<=[.!?])\s+')
+_WORD_RE = re.compile(r'\S+')
+_SPACE_RE = re.compile(r'\s+')
+# Oversized chunk pairs are halved at a boundary no further than len // _HALF_SPLIT_WINDOW_DIVISOR from the
+# middle; the new chunk is cut where the text around the original's cut recurs (_SPLIT_ANCHOR_CHARS each side).
+_HALF_SPLIT_WINDOW_DIVISOR = 4
+_SPLIT_ANCHOR_CHARS = 64
+
+# Shared by the single-pair and batched system prompts; kept short because it is sent with every call.
+_BLOCK_RULES = (
+    'Block: {"status": "equal"|"deleted"|"added"|"modified", "text1": str, "text2": str}. Blocks cover both '
+    'texts in order with no gaps or overlaps: joined text1 = original exactly, joined text2 = new exactly '
+    '(keep whitespace and newlines). text1 is "" if added, text2 is "" if deleted. modified = edited version '
+    'of the same passage, else deleted + added.'
+)
+
+# Disk persistence is opt-in: set this variable to a directory (and install diskcache) to keep change blocks
+# between runs. They hold both documents' text, so the disk cache is bounded in size and age.
+RESULT_CACHE_DIR_ENV = "DOCUDIFF_RESULT_CACHE_DIR"
+_DISK_CACHE_SIZE_LIMIT = 256 * 1024 * 1024
+_DISK_CACHE_EXPIRE_SECONDS = 7 * 24 * 3600
+_MEMORY_CACHE_MAX_ENTRIES = 1024
+# Part of every cache key; bump it whenever the prompts or the block schema change.
+RESULT_CACHE_VERSION = 1
+
+class ChangeBlockCache:
+    """
+    Exact-match cache of validated change blocks per (model, chunk pair).
+    Persists to disk with diskcache when given a directory, otherwise keeps a bounded in-process LRU.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self._disk = None
+        if directory and diskcache is not None:
+            try:
+                self._disk = diskcache.Cache(directory, size_limit=_DISK_CACHE_SIZE_LIMIT)
+            except Exception as e:
+                print(f"Warning: Could not open result cache at {directory}: {e}")
+        self._memory: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name: str, original_chunk: str, new_chunk: str) -> str:
+        return hashlib.blake2b(f"v{RESULT_CACHE_VERSION}|{model_name}|{original_chunk}\x00{new_chunk}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        if self._disk is not None:
+            blocks = self._disk.get(key)
+        else:
+            with self._memory_lock:
+                blocks = self._memory.get(key)
+                if blocks is not None:
+                    self._memory.move_to_end(key)
+        # Callers annotate blocks in place, so hand out copies.
+        return [dict(block) for block in blocks] if blocks is not None else None
+
+    def set(self, key: str, blocks: List[Dict]) -> None:
+        blocks = [dict(block) for block in blocks]
+        if self._disk is not None:
+            self._disk.set(key, blocks, expire=_DISK_CACHE_EXPIRE_SECONDS)
+            return
+        with self._memory_lock:
+            self._memory[key] = blocks
+            self._memory.move_to_end(key)
+            if len(self._memory) > _MEMORY_CACHE_MAX_ENTRIES:
+                self._memory.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def _get_result_cache() -> ChangeBlockCache:
+    """Process-wide change block cache, opened on first use; on disk only if RESULT_CACHE_DIR_ENV is set."""
+    return ChangeBlockCache(os.environ.get(RESULT_CACHE_DIR_ENV) or None)
+
+
+class AsyncRateLimiter:
+    """
+    Proactive limiter for requests-per-minute and tokens-per-minute budgets.
+    Both buckets refill continuously; acquire() waits until the request fits.
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = max(requests_per_minute, 1)
+        self.tokens_per_minute = max(tokens_per_minute, 1)
+        self._available_requests = float(self.requests_per_minute)
+        self._available_tokens = float(self.tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        self._available_requests = min(self.requests_per_minute,
+                                       self._available_requests + elapsed_minutes * self.requests_per_minute)
+        self._available_tokens = min(self.tokens_per_minute,
+                                     self._available_tokens + elapsed_minutes * self.tokens_per_minute)
+
+    async def acquire(self, request_tokens: int = 0) -> None:
+        """Waits until one request and request_tokens tokens are available, then consumes them."""
+        # A request larger than the whole bucket can only ever wait for a full bucket.
+        request_tokens = min(request_tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._available_requests >= 1 and self._available_tokens >= request_tokens:
+                    self._available_requests -= 1
+                    self._available_tokens -= request_tokens
+                    return
+                wait_for_request = (1 - self._available_requests) * 60 / self.requests_per_minute
+                wait_for_tokens = (request_tokens - self._available_tokens) * 60 / self.tokens_per_minute
+                await asyncio.sleep(max(wait_for_request, wait_for_tokens, 0.01))
 
 class GroqPDFComparator:
     """
@@ -25,9 +164,48 @@ class GroqPDFComparator:
     Handles text extraction, chunking, API calls, and renders word-level diffs.
     """
     DEFAULT_MODEL = "llama3-8b-8192"
+    DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+    DEFAULT_REQUESTS_PER_MINUTE = 30
+    DEFAULT_TOKENS_PER_MINUTE = 30000
+    MAX_TRANSIENT_RETRIES = 4
+    MAX_DEBUG_LOG_ENTRIES = 200
+    NEAR_IDENTICAL_THRESHOLD = 0.99
+    BATCH_TOKEN_BUDGET = 4000
+    MAX_COMPLETION_TOKENS = 8000
+    CHANGE_BLOCK_SYSTEM_PROMPT = (
+        'Compare <original> and <new>. Reply with ONLY a JSON object {"change_blocks": [...]}. '
+        + _BLOCK_RULES +
+        ' Example: {"change_blocks": [{"status": "equal", "text1": "A ", "text2": "A "}, '
+        '{"status": "modified", "text1": "old", "text2": "new"}]}'
+    )
+    BATCH_SYSTEM_PROMPT = (
+        'Compare <original> and <new> of each <pair index="N"> independently. Reply with ONLY a JSON object '
+        '{"pairs": [{"index": N, "change_blocks": [...]}]}, one entry per pair. '
+        + _BLOCK_RULES +
+        ' Never mix text between pairs.'
+    )
+    DEFAULT_CONTEXT_WINDOW = 8192
+    MODEL_CONTEXT_WINDOWS = {
+        "gemma2-9b-it": 8192,
+        "llama-3.3-70b-versatile": 131072,
+        "llama-3.1-8b-instant": 131072,
+        "llama3-70b-8192": 8192,
+        "llama3-8b-8192": 8192,
+        "meta-llama/llama-4-scout-17b-16e-instruct": 131072,
+        "meta-llama/llama-4-maverick-17b-128e-instruct": 131072,
+        "qwen-2.5-32b": 131072,
+        "deepseek-r1-distill-qwen-32b": 131072,
+        "deepseek-r1-distill-llama-70b": 131072,
+    }
 
     def __init__(self, pdf_file_obj_1: Any, pdf_file_obj_2: Any, groq_client: Groq,
-                 model_name: str = DEFAULT_MODEL, max_chunk_tokens: int = 2000):
+                 model_name: str = DEFAULT_MODEL, max_chunk_tokens: int = 2000,
+                 async_groq_client: Optional[AsyncGroq] = None,
+                 max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS,
+                 requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+                 tokenizer_name: str = DEFAULT_TOKENIZER_NAME,
+                 use_result_cache: bool = True):
         """
         Initializes the LLM comparator.
 
@@ -37,13 +215,30 @@ class GroqPDFComparator:
             groq_client: An initialized Groq API client instance.
             model_name: The name of the Groq model to use.
             max_chunk_tokens: Maximum tokens per chunk for LLM processing.
+            async_groq_client: Optional AsyncGroq client; if omitted, one is created from groq_client's
+                               API key for each comparison run and closed afterwards.
+            max_concurrent_requests: Maximum number of chunk pairs sent to the API at once.
+            requests_per_minute: Request budget enforced before each API call.
+            tokens_per_minute: Token budget enforced before each API call.
+            tokenizer_name: Tiktoken encoding used for chunking and token budgeting.
+            use_result_cache: Reuse change blocks from earlier runs for identical chunk pairs.
         """
-        if not tiktoken_found or tokenizer is None:
+        if not tiktoken_found:
             raise ImportError("Tiktoken library is required and must initialize correctly for LLM comparison.")
+        try:
+            self.tokenizer = _get_tokenizer(tokenizer_name or DEFAULT_TOKENIZER_NAME)
+        except Exception as e:
+            raise ImportError(f"Could not initialize Tiktoken tokenizer '{tokenizer_name}': {e}") from e
 
         self.pdf_file_obj_1 = pdf_file_obj_1
         self.pdf_file_obj_2 = pdf_file_obj_2
         self.groq_client = groq_client
+        self.async_groq_client = async_groq_client
+        self.max_concurrent_requests = max(max_concurrent_requests, 1)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._rate_limiter: Optional[AsyncRateLimiter] = None
+        self._result_cache: Optional[ChangeBlockCache] = _get_result_cache() if use_result_cache else None
         self.model_name = model_name if model_name else self.DEFAULT_MODEL
         self.max_chunk_tokens = max(max_chunk_tokens, 500)
 
@@ -56,67 +251,101 @@ class GroqPDFComparator:
         self.rendered_html: Optional[str] = None
         self.summary: Dict = self._get_default_summary()
         self.api_call_counter: int = 0
-        self.debug_logs: List[Tuple[str, str]] = []
+        # (entry number, prompt, response); numbers keep counting once the oldest entries are dropped.
+        self.debug_logs: Deque[Tuple[int, str, str]] = deque(maxlen=self.MAX_DEBUG_LOG_ENTRIES)
+        self._debug_log_count: int = 0
+        self._chunk_token_counts: Dict[str, int] = {}
+
+    def _log_debug(self, prompt: str, response: str) -> None:
+        """Records a debug log entry under its absolute number, keeping only the latest MAX_DEBUG_LOG_ENTRIES."""
+        self._debug_log_count += 1
+        self.debug_logs.append((self._debug_log_count, prompt, response))
 
     @staticmethod
     def _get_default_summary() -> Dict:
         """Returns the default structure for the summary."""
         return {"added_chars": 0, "deleted_chars": 0, "modified_blocks": 0, "modified_chars": 0}
 
+    @staticmethod
+    def _split_common_paragraphs(text1: str, text2: str) -> Tuple[str, str, str, str]:
+        """
+        Separates the paragraphs both documents share at their start and end from the differing middle,
+        so only the middle needs chunking and API calls.
+
+        Returns:
+            Tuple[str, str, str, str]: (common prefix, middle of text1, middle of text2, common suffix).
+                                       Non-empty prefix/suffix text carries the paragraph break
+                                       that joins it to whatever follows or precedes it.
+        """
+        paragraphs1 = _PARA_RE.split(text1.strip())
+        paragraphs2 = _PARA_RE.split(text2.strip())
+        separator = "\n\n"
+
+        limit = min(len(paragraphs1), len(paragraphs2))
+        prefix_count = 0
+        while prefix_count < limit and paragraphs1[prefix_count] == paragraphs2[prefix_count]:
+            prefix_count += 1
+        suffix_count = 0
+        while (suffix_count < limit - prefix_count
+               and paragraphs1[-1 - suffix_count] == paragraphs2[-1 - suffix_count]):
+            suffix_count += 1
+
+        if not prefix_count and not suffix_count:
+            return "", text1, text2, ""
+
+        end1 = len(paragraphs1) - suffix_count
+        end2 = len(paragraphs2) - suffix_count
+        middle1 = separator.join(paragraphs1[prefix_count:end1])
+        middle2 = separator.join(paragraphs2[prefix_count:end2])
+        suffix_text = separator + separator.join(paragraphs1[end1:]) if suffix_count else ""
+        prefix_text = separator.join(paragraphs1[:prefix_count])
+        # If every paragraph matched, nothing follows and a trailing break would render as an empty paragraph.
+        if prefix_text and (middle1 or middle2 or suffix_text):
+            prefix_text += separator
+        return prefix_text, middle1, middle2, suffix_text
+
     def _chunk_text_by_tokens(self, text: str) -> List[str]:
         """Chunks text into pieces smaller than max_chunk_tokens using Tiktoken."""
-        if not text or tokenizer is None: return []
+        if not text: return []
 
-        parts = re.split(r'\n\s*\n', text.strip())
+        stripped_text = text.strip()
+        parts = _PARA_RE.split(stripped_text)
         if len(parts) <= 1:
-            parts = re.split(r'(?<=[.!?])\s+', text.strip())
+            parts = _SENT_RE.split(stripped_text)
             if len(parts) <= 1:
-                parts = text.strip().split('\n')
+                parts = stripped_text.split('\n')
                 if len(parts) <= 1:
-                     parts = text.strip().split()
+                     parts = stripped_text.split()
+
+        parts = [part for part in (part.strip() for part in parts) if part]
+        # One batched call encodes every part in parallel native threads.
+        part_encodings = self.tokenizer.encode_ordinary_batch(parts, num_threads=os.cpu_count() or 1)
+        part_lens = [len(encoded) for encoded in part_encodings]
 
         chunks = []
         current_chunk_parts = []
         current_token_count = 0
         separator = "\n\n"
-        separator_tokens = len(tokenizer.encode(separator))
+        # Chunk sizes are tracked from these precomputed lengths only; assembled chunks are never re-encoded.
+        separator_tokens = len(self.tokenizer.encode_ordinary(separator))
 
-        for i, part in enumerate(parts):
-            part = part.strip()
-            if not part: continue
-
-            part_tokens = len(tokenizer.encode(part))
+        def add_chunk(chunk: str, token_count: int) -> None:
+            chunks.append(chunk)
+            self._chunk_token_counts[chunk] = token_count
 
+        for part, part_tokens, encoded in zip(parts, part_lens, part_encodings):
             if part_tokens > self.max_chunk_tokens:
                 if current_chunk_parts:
-                    chunks.append(separator.join(current_chunk_parts))
+                    add_chunk(separator.join(current_chunk_parts), current_token_count)
                     current_chunk_parts = []
                     current_token_count = 0
 
-                words = part.split()
-                sub_chunk = ""
-                sub_chunk_tokens = 0
-                for word in words:
-                    word_prefix = separator if sub_chunk else ""
-                    word_token_estimate = len(tokenizer.encode(word_prefix + word)) - len(tokenizer.encode(word_prefix))
-
-                    if sub_chunk_tokens + word_token_estimate <= self.max_chunk_tokens:
-                        sub_chunk += (" " if sub_chunk else "") + word
-                        sub_chunk_tokens += word_token_estimate
-                    else:
-                        if sub_chunk: chunks.append(sub_chunk)
-                        word_alone_tokens = len(tokenizer.encode(word))
-                        if word_alone_tokens <= self.max_chunk_tokens:
-                             sub_chunk = word
-                             sub_chunk_tokens = word_alone_tokens
-                        else:
-                             print(f"Warning: Word exceeds max_chunk_tokens, truncating: '{word[:100]}...'")
-                             encoded_word = tokenizer.encode(word)
-                             truncated_word = tokenizer.decode(encoded_word[:self.max_chunk_tokens])
-                             chunks.append(truncated_word)
-                             sub_chunk = ""
-                             sub_chunk_tokens = 0
-                if sub_chunk: chunks.append(sub_chunk)
+                # Token windows can end mid-character; the incremental decoder carries partial bytes over.
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                for start in range(0, part_tokens, self.max_chunk_tokens):
+                    end = start + self.max_chunk_tokens
+                    window_bytes = self.tokenizer.decode_bytes(encoded[start:end])
+                    add_chunk(decoder.decode(window_bytes, final=end >= part_tokens), len(encoded[start:end]))
                 continue
 
             potential_tokens = current_token_count + (separator_tokens if current_chunk_parts else 0) + part_tokens
@@ -125,91 +354,169 @@ class GroqPDFComparator:
                 current_token_count = potential_tokens
             else:
                 if current_chunk_parts:
-                    chunks.append(separator.join(current_chunk_parts))
+                    add_chunk(separator.join(current_chunk_parts), current_token_count)
                 current_chunk_parts = [part]
                 current_token_count = part_tokens
 
         if current_chunk_parts:
-            chunks.append(separator.join(current_chunk_parts))
+            add_chunk(separator.join(current_chunk_parts), current_token_count)
 
         return [chunk for chunk in chunks if chunk.strip()]
 
     @staticmethod
     def _create_change_block_prompt(original_chunk: str, new_chunk: str) -> str:
-        """Creates the structured prompt for the Groq API."""
-        prompt = f"""
-            Analyze the 'Original Text' and 'New Text' below. Identify all changes and represent them as a sequence of blocks.
-            
-            Your response MUST be a single, valid JSON object containing ONLY the key "change_blocks".
-            The value of "change_blocks" MUST be a JSON array `[]` of block objects.
-            Each block object in the array MUST have the following keys:
-            - "status": A string, must be one of: "equal", "deleted", "added", "modified".
-            - "text1": A string containing the relevant text from the Original Text. This MUST be an empty string "" if status is "added".
-            - "text2": A string containing the relevant text from the New Text. This MUST be an empty string "" if status is "deleted".
-            
-            Guidelines:
-            - Represent the *entire* content of both inputs through the sequence of blocks.
-            - Maintain original text segments and line breaks within the "text1" and "text2" values accurately. Use `\\n` for newlines within the JSON strings if necessary.
-            - Use "equal" for segments that are identical in both texts.
-            - Use "deleted" where text exists in Original but not New (text2 must be "").
-            - Use "added" where text exists in New but not Original (text1 must be "").
-            - Use "modified" ONLY for segments that correspond conceptually but have internal changes (e.g., rephrasing, correction). Prefer "deleted" + "added" if text is completely different or unrelated.
-            - Ensure the blocks cover the text sequentially without gaps or overlaps. The concatenation of 'text1' from all blocks should reconstruct the Original Text chunk, and 'text2' should reconstruct the New Text chunk.
-            
-            Example JSON Response Structure:
-            ```json
-            {{
-              "change_blocks": [
-                {{"status": "equal", "text1": "This part is unchanged.\\n", "text2": "This part is unchanged.\\n"}},
-                {{"status": "modified", "text1": "The old sentence.", "text2": "The revised sentence."}},
-                {{"status": "deleted", "text1": "This section was removed.", "text2": ""}},
-                {{"status": "added", "text1": "", "text2": "This section was newly added."}},
-                {{"status": "equal", "text1": " The end.", "text2": " The end."}}
-              ]
-            }}
-            Use code with caution.
-            Python
-            DO NOT include any text outside the single JSON object structure (like "```json" markers or explanations) in your final output.
-            --- Original Text ---
-            {original_chunk}
-            --- End Original Text ---
-            --- New Text ---
-            {new_chunk}
-            --- End New Text ---
-            Now, provide the JSON output:
+        """Creates the user message for one chunk pair; the instructions live in CHANGE_BLOCK_SYSTEM_PROMPT."""
+        return f"<original>\n{original_chunk}\n</original>\n<new>\n{new_chunk}\n</new>"
+
+    @staticmethod
+    def _create_batched_prompt(pairs: List[Tuple[str, str]]) -> str:
+        """Creates the user message for several chunk pairs; the instructions live in BATCH_SYSTEM_PROMPT."""
+        return "\n".join(
+            f'<pair index="{index}">\n<original>\n{original_chunk}\n</original>\n<new>\n{new_chunk}\n</new>\n</pair>'
+            for index, (original_chunk, new_chunk) in enumerate(pairs)
+        )
+
+    @staticmethod
+    def _retry_delay(error: APIError, attempt: int) -> float:
+        """Seconds to wait before retrying: the server's retry-after if given, else exponential backoff with jitter."""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            if retry_after is not None:
+                return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        return min(2 ** attempt, 30) + random.uniform(0, 1)
+
+    def _get_cached_blocks(self, original_chunk: str, new_chunk: str) -> Optional[List[Dict]]:
+        """Returns cached change blocks for a chunk pair, or None on a miss or with caching disabled."""
+        if self._result_cache is None:
+            return None
+        return self._result_cache.get(ChangeBlockCache.make_key(self.model_name, original_chunk, new_chunk))
+
+    def _store_cached_blocks(self, original_chunk: str, new_chunk: str, blocks: List[Dict]) -> None:
+        """Stores validated change blocks for a chunk pair when caching is enabled."""
+        if self._result_cache is not None:
+            self._result_cache.set(ChangeBlockCache.make_key(self.model_name, original_chunk, new_chunk), blocks)
+
+    @staticmethod
+    def _validate_change_blocks(change_blocks: List[Any]) -> List[Dict]:
+        """Checks the structure of LLM change blocks, normalizing text fields; raises ValueError if invalid."""
+        validated_blocks = []
+        for i, item in enumerate(change_blocks):
+            if not isinstance(item, dict): raise ValueError(f"Block {i} is not a JSON object.")
+            status = item.get("status")
+            text1 = item.get("text1")
+            text2 = item.get("text2")
+            valid_statuses = ["equal", "added", "deleted", "modified"]
+            if status not in valid_statuses: raise ValueError(f"Block {i} has invalid status '{status}'. Must be one of {valid_statuses}.")
+            if text1 is not None and not isinstance(text1, str): raise ValueError(f"Block {i} 'text1' is not a string.")
+            if text2 is not None and not isinstance(text2, str): raise ValueError(f"Block {i} 'text2' is not a string.")
+
+            item["text1"] = item.get("text1", "") or ""
+            item["text2"] = item.get("text2", "") or ""
+
+
+            if status == "deleted" and item["text2"] != "":
+                print(f"Warning: Correcting block {i} ('deleted'): setting text2 to empty.")
+                item["text2"] = ""
+
+            if status == "added" and item["text1"] != "":
+                print(f"Warning: Correcting block {i} ('added'): setting text1 to empty.")
+                item["text1"] = ""
+
+            if status == "modified" and (not item["text1"] or not item["text2"]):
+                print(f"Warning: Block {i} ('modified') has empty text1 or text2.")
+
+            if status == "equal":
+                if item["text1"] == item["text2"]:
+                    # Point both fields at one string so equal text is held in memory once.
+                    item["text2"] = item["text1"]
+                else:
+                    print(f"Warning: Block {i} ('equal') has different text1/text2.")
+
+            validated_blocks.append(item)
+
+        return validated_blocks
+
+    def _completion_budget(self, prompt_tokens: int) -> Optional[int]:
         """
-        return prompt.strip()
-    def _call_groq_change_blocks(self, original_chunk: str, new_chunk: str) -> Optional[List[Dict]]:
-        """Calls the Groq API, handles errors, and parses the JSON response."""
+        Returns the max_tokens to request for a prompt, or None when the prompt and its
+        expected answer would not fit the model's context window.
+        """
+        # The JSON answer restates both texts, so expect roughly the prompt size again for it.
+        available = self.MODEL_CONTEXT_WINDOWS.get(self.model_name, self.DEFAULT_CONTEXT_WINDOW) - prompt_tokens
+        if available < prompt_tokens:
+            return None
+        return min(self.MAX_COMPLETION_TOKENS, available)
+
+    def _count_prompt_tokens(self, system_prompt: str, prompt: str) -> int:
+        """Token count of the system and user messages together."""
+        return len(self.tokenizer.encode_ordinary(system_prompt)) + len(self.tokenizer.encode_ordinary(prompt))
+
+    async def _acreate_completion(self, system_prompt: str, prompt: str, call_number: int, prompt_tokens: int,
+                                  max_tokens: int) -> Tuple[str, float]:
+        """Sends one prompt under the rate limiter, retrying 429s, and returns (raw content, duration)."""
+        request_tokens = 2 * prompt_tokens
+        for attempt in range(self.MAX_TRANSIENT_RETRIES + 1):
+            if self._rate_limiter is not None:
+                await self._rate_limiter.acquire(request_tokens)
+            start_time = time.time()
+            print(f"Calling Groq API (Call #{call_number})...") # Debug print
+            try:
+                chat_completion = await self.async_groq_client.chat.completions.create(
+                     messages=[{"role": "system", "content": system_prompt},
+                               {"role": "user", "content": prompt}],
+                     model=self.model_name,
+                     temperature=0.1,
+                     max_tokens=max_tokens,
+                     response_format={"type": "json_object"},
+                )
+                break
+            except (RateLimitError, APIConnectionError) as transient_error:
+                if attempt == self.MAX_TRANSIENT_RETRIES:
+                    raise
+                delay = self._retry_delay(transient_error, attempt)
+                error_name = type(transient_error).__name__
+                print(f"{error_name} on call #{call_number}, retrying in {delay:.1f}s (attempt {attempt + 1}).")
+                self._log_debug(prompt, f"RETRY: {error_name} - {transient_error} (waiting {delay:.1f}s)")
+                await asyncio.sleep(delay)
+        end_time = time.time()
+        duration = end_time - start_time
+        print(f"Groq API Call #{call_number} completed in {duration:.2f}s.") # Debug print
+        return chat_completion.choices[0].message.content, duration
+
+    async def _acall_groq_change_blocks(self, original_chunk: str, new_chunk: str) -> Optional[List[Dict]]:
+        """Calls the Groq API asynchronously, handles errors, and parses the JSON response."""
         prompt = self._create_change_block_prompt(original_chunk, new_chunk)
         raw_response_content = "Error: No response received"
         log_entry: Tuple[str, str] = (prompt, "")
 
+        prompt_tokens = self._count_prompt_tokens(self.CHANGE_BLOCK_SYSTEM_PROMPT, prompt)
+        max_tokens = self._completion_budget(prompt_tokens)
+        if max_tokens is None:
+            halves = self._split_pair_in_half(original_chunk, new_chunk)
+            if halves is not None:
+                print(f"Prompt of {prompt_tokens} tokens is too large for {self.model_name}; splitting the chunk pair locally.")
+                return await self._acall_split_change_blocks(original_chunk, new_chunk, halves)
+            context_window = self.MODEL_CONTEXT_WINDOWS.get(self.model_name, self.DEFAULT_CONTEXT_WINDOW)
+            max_tokens = min(self.MAX_COMPLETION_TOKENS, max(context_window - prompt_tokens, 1))
+
         try:
             self.api_call_counter += 1
-            start_time = time.time()
-            print(f"Calling Groq API (Call #{self.api_call_counter})...") # Debug print
-            chat_completion = self.groq_client.chat.completions.create(
-                 messages=[{"role": "user", "content": prompt}],
-                 model=self.model_name,
-                 temperature=0.1,
-                 max_tokens=8000,
-                 response_format={"type": "json_object"},
-            )
-            end_time = time.time()
-            raw_response_content = chat_completion.choices[0].message.content
-            duration = end_time - start_time
-            print(f"Groq API Call #{self.api_call_counter} completed in {duration:.2f}s.") # Debug print
+            call_number = self.api_call_counter
+            raw_response_content, duration = await self._acreate_completion(self.CHANGE_BLOCK_SYSTEM_PROMPT, prompt, call_number,
+                                                                             prompt_tokens, max_tokens)
 
             try:
-                result = json.loads(raw_response_content)
+                result = _json_loads(raw_response_content)
             except json.JSONDecodeError as json_e:
                 log_entry = (prompt, f"ERROR: Invalid JSON received - {json_e}\nRaw Response:\n{raw_response_content}")
-                self.debug_logs.append(log_entry)
+                self._log_debug(*log_entry)
                 raise ValueError(f"LLM returned invalid JSON: {json_e}") from json_e
 
             log_entry = (prompt, f"Success ({duration:.2f}s):\n{raw_response_content}")
-            self.debug_logs.append(log_entry)
+            self._log_debug(*log_entry)
 
 
             if not isinstance(result, dict) or "change_blocks" not in result:
@@ -219,59 +526,31 @@ class GroqPDFComparator:
             if not isinstance(change_blocks, list):
                  raise ValueError("'change_blocks' value is not a JSON array.")
 
-            # Validate each block structure
-            validated_blocks = []
-            for i, item in enumerate(change_blocks):
-                if not isinstance(item, dict): raise ValueError(f"Block {i} is not a JSON object.")
-                status = item.get("status")
-                text1 = item.get("text1")
-                text2 = item.get("text2")
-                valid_statuses = ["equal", "added", "deleted", "modified"]
-                if status not in valid_statuses: raise ValueError(f"Block {i} has invalid status '{status}'. Must be one of {valid_statuses}.")
-                if text1 is not None and not isinstance(text1, str): raise ValueError(f"Block {i} 'text1' is not a string.")
-                if text2 is not None and not isinstance(text2, str): raise ValueError(f"Block {i} 'text2' is not a string.")
-
-                item["text1"] = item.get("text1", "") or ""
-                item["text2"] = item.get("text2", "") or ""
-
-
-                if status == "deleted" and item["text2"] != "":
-                    print(f"Warning: Correcting block {i} ('deleted'): setting text2 to empty.")
-                    item["text2"] = ""
-
-                if status == "added" and item["text1"] != "":
-                    print(f"Warning: Correcting block {i} ('added'): setting text1 to empty.")
-                    item["text1"] = ""
-
-                if status == "modified" and (not item["text1"] or not item["text2"]):
-                    print(f"Warning: Block {i} ('modified') has empty text1 or text2.")
-
-                if status == "equal" and item["text1"] != item["text2"]:
-                    print(f"Warning: Block {i} ('equal') has different text1/text2.")
-
-                validated_blocks.append(item)
-
+            validated_blocks = self._validate_change_blocks(change_blocks)
+            self._store_cached_blocks(original_chunk, new_chunk, validated_blocks)
             return validated_blocks
 
         except RateLimitError as rle:
             self.error_message = f"API Rate Limit Error: {rle}. Please wait and try again."
             print(f"Rate Limit Error: {rle}")
             log_entry = (prompt, f"ERROR: RateLimitError - {rle}")
-            if log_entry not in self.debug_logs: self.debug_logs.append(log_entry)
-            time.sleep(5)
+            self._log_debug(*log_entry)
             return None
         except BadRequestError as bre:
              # Often happens if the prompt + response exceeds model context or other input issues
              self.error_message = f"API Bad Request Error: {bre}. Check input size/content or model compatibility."
              print(f"Bad Request Error: {bre}")
              log_entry = (prompt, f"ERROR: BadRequestError - {bre}\nRaw Response:\n{raw_response_content}")
-             if log_entry not in self.debug_logs: self.debug_logs.append(log_entry)
+             self._log_debug(*log_entry)
              return None
         except APIError as apie:
-            self.error_message = f"Groq API Error ({apie.status_code}): {apie.message}"
+            # Connection errors carry no HTTP status.
+            status_code = getattr(apie, "status_code", None)
+            self.error_message = (f"Groq API Error ({status_code}): {apie.message}" if status_code is not None
+                                  else f"Groq API Connection Error: {apie.message}")
             print(f"API Error: {apie}")
             log_entry = (prompt, f"ERROR: APIError - {apie}\nRaw Response:\n{raw_response_content}")
-            if log_entry not in self.debug_logs: self.debug_logs.append(log_entry)
+            self._log_debug(*log_entry)
             return None
 
         except ValueError as ve:
@@ -279,7 +558,7 @@ class GroqPDFComparator:
              print(f"Value Error: {ve}")
              if "Invalid JSON" not in str(ve):
                  log_entry = (prompt, f"ERROR: ValueError - {ve}\nRaw Response:\n{raw_response_content}")
-                 if log_entry not in self.debug_logs: self.debug_logs.append(log_entry)
+                 self._log_debug(*log_entry)
              return None
 
         except Exception as e:
@@ -287,25 +566,190 @@ class GroqPDFComparator:
             self.error_message = f"Unexpected Error during API Call: {type(e).__name__} - {e}"
             print(f"Unexpected Error: {e}")
             log_entry = (prompt, f"ERROR: {type(e).__name__} - {e}\nRaw Response:\n{raw_response_content}")
-            if log_entry not in self.debug_logs: self.debug_logs.append(log_entry)
+            self._log_debug(*log_entry)
             return None
 
     @staticmethod
-    def _render_word_diff_html(text1: str, text2: str) -> str:
-        """Performs word-level diff and renders HTML with specific styling."""
-        words1 = re.split(r'(\s+)', text1)
-        words2 = re.split(r'(\s+)', text2)
+    def _boundary_near(text: str, target: int) -> int:
+        """
+        Paragraph, then sentence, then word boundary closest to target, considering only boundaries within
+        len(text) // _HALF_SPLIT_WINDOW_DIVISOR of it; target itself when no pattern has one in range.
+        """
+        window = len(text) // _HALF_SPLIT_WINDOW_DIVISOR
+        for pattern in (_PARA_RE, _SENT_RE, _SPACE_RE):
+            boundaries = [end for end in (match.end() for match in pattern.finditer(text))
+                          if 0 < end < len(text) and abs(end - target) <= window]
+            if boundaries:
+                return min(boundaries, key=lambda end: abs(end - target))
+        return target
+
+    @classmethod
+    def _aligned_cut(cls, original_chunk: str, cut: int, new_chunk: str) -> int:
+        """
+        Position in new_chunk corresponding to `cut` in original_chunk: where the text just after (or just
+        before) the cut recurs, nearest the proportional position; otherwise a boundary near that position.
+        """
+        target = cut * len(new_chunk) // max(len(original_chunk), 1)
+        after = original_chunk[cut:cut + _SPLIT_ANCHOR_CHARS]
+        before = original_chunk[max(cut - _SPLIT_ANCHOR_CHARS, 0):cut]
+        for anchor, offset in ((after, 0), (before, len(before))):
+            if not anchor.strip():
+                continue
+            positions = []
+            start = new_chunk.find(anchor)
+            while start != -1:
+                positions.append(start + offset)
+                start = new_chunk.find(anchor, start + 1)
+            if positions:
+                return min(positions, key=lambda position: abs(position - target))
+        return cls._boundary_near(new_chunk, target)
 
-        words1 = [w for w in words1 if w]
-        words2 = [w for w in words2 if w]
+    @classmethod
+    def _split_pair_in_half(cls, original_chunk: str, new_chunk: str) -> Optional[List[Tuple[str, str]]]:
+        """
+        Splits the original chunk near its middle and the new chunk at the matching position, so each half
+        of one is compared with the same passage of the other; None when neither can shrink any further.
+        """
+        if len(original_chunk) < 2 and len(new_chunk) < 2:
+            return None
+        if len(original_chunk) < 2:
+            new_cut = cls._boundary_near(new_chunk, len(new_chunk) // 2)
+            return [(original_chunk, new_chunk[:new_cut]), ("", new_chunk[new_cut:])]
+        original_cut = cls._boundary_near(original_chunk, len(original_chunk) // 2)
+        new_cut = cls._aligned_cut(original_chunk, original_cut, new_chunk)
+        return [(original_chunk[:original_cut], new_chunk[:new_cut]), (original_chunk[original_cut:], new_chunk[new_cut:])]
+
+    @staticmethod
+    def _trivial_change_blocks(original_chunk: str, new_chunk: str) -> Optional[List[Dict]]:
+        """Change blocks for pairs that need no diffing (empty, one-sided or identical), else None."""
+        if not original_chunk.strip() and not new_chunk.strip():
+            return [{"status": "equal", "text1": original_chunk, "text2": new_chunk}] if original_chunk or new_chunk else []
+        if not original_chunk.strip():
+            return [{"status": "added", "text1": "", "text2": new_chunk}]
+        if not new_chunk.strip():
+            return [{"status": "deleted", "text1": original_chunk, "text2": ""}]
+        if original_chunk == new_chunk:
+            return [{"status": "equal", "text1": original_chunk, "text2": original_chunk}]
+        return None
+
+    async def _acall_split_change_blocks(self, original_chunk: str, new_chunk: str,
+                                         halves: List[Tuple[str, str]]) -> Optional[List[Dict]]:
+        """Diffs each half of an oversized chunk pair separately and concatenates the change blocks."""
+        change_blocks: List[Dict] = []
+        for half_original, half_new in halves:
+            half_blocks = self._trivial_change_blocks(half_original, half_new)
+            if half_blocks is None:
+                half_blocks = await self._acall_groq_change_blocks(half_original, half_new)
+            if half_blocks is None:
+                return None
+            change_blocks.extend(half_blocks)
+
+        self._store_cached_blocks(original_chunk, new_chunk, change_blocks)
+        return change_blocks
+
+    async def _acall_groq_change_blocks_batch(self, pairs: List[Tuple[str, str]]) -> Optional[List[List[Dict]]]:
+        """
+        Sends several chunk pairs in one request.
+
+        Returns:
+            Optional[List[List[Dict]]]: Validated change blocks per pair, in input order, or None if the
+                                        request or its validation failed and the caller should fall back
+                                        to single-pair requests.
+        """
+        prompt = self._create_batched_prompt(pairs)
+        raw_response_content = "Error: No response received"
+
+        prompt_tokens = self._count_prompt_tokens(self.BATCH_SYSTEM_PROMPT, prompt)
+        max_tokens = self._completion_budget(prompt_tokens)
+        if max_tokens is None:
+            print(f"Batched prompt of {prompt_tokens} tokens is too large for {self.model_name}; sending pairs individually.")
+            return None
+
+        try:
+            self.api_call_counter += 1
+            raw_response_content, duration = await self._acreate_completion(self.BATCH_SYSTEM_PROMPT, prompt,
+                                                                             self.api_call_counter,
+                                                                             prompt_tokens, max_tokens)
+            result = _json_loads(raw_response_content)
+            self._log_debug(prompt, f"Success ({duration:.2f}s):\n{raw_response_content}")
+
+            if not isinstance(result, dict) or not isinstance(result.get("pairs"), list):
+                raise ValueError("LLM response missing 'pairs' array in the root JSON object.")
+
+            blocks_by_index: Dict[int, List[Dict]] = {}
+            for item in result["pairs"]:
+                if not isinstance(item, dict) or not isinstance(item.get("change_blocks"), list):
+                    raise ValueError("Pair entry is not an object with a 'change_blocks' array.")
+                index = item.get("index")
+                if not isinstance(index, int) or not 0 <= index < len(pairs) or index in blocks_by_index:
+                    raise ValueError(f"Pair entry has invalid or duplicate index {index!r}.")
+                blocks_by_index[index] = self._validate_change_blocks(item["change_blocks"])
+
+            if len(blocks_by_index) != len(pairs):
+                raise ValueError(f"Expected {len(pairs)} pairs, got {len(blocks_by_index)}.")
+
+            pair_results = [blocks_by_index[index] for index in range(len(pairs))]
+            for (original_chunk, new_chunk), blocks in zip(pairs, pair_results):
+                self._store_cached_blocks(original_chunk, new_chunk, blocks)
+            return pair_results
+
+        except Exception as e:
+            print(f"Batched API call failed ({type(e).__name__}: {e}); retrying pairs individually.")
+            self._log_debug(prompt, f"ERROR: {type(e).__name__} - {e}\nRaw Response:\n{raw_response_content}")
+            return None
+
+    @staticmethod
+    def _split_word_segments(text: str) -> Tuple[List[str], List[str]]:
+        """
+        Splits text into words for diffing plus parallel segments for rendering.
+        Segment k is word k with the whitespace after it (the first also carries any leading
+        whitespace), so joining a run of segments reproduces that stretch of the text exactly.
+        """
+        words = text.split()
+        if not words:
+            return ([text], [text]) if text else ([], [])
+
+        starts = [match.start() for match in _WORD_RE.finditer(text)]
+        starts[0] = 0
+        starts.append(len(text))
+        segments = [text[starts[k]:starts[k + 1]] for k in range(len(words))]
+        return words, segments
+
+    @classmethod
+    def _diff_modified_block(cls, text1: str, text2: str) -> Tuple[List[Tuple[str, int, int, int, int]], List[str], List[str]]:
+        """
+        Word-level diff of a modified block, returned as (opcodes, segments1, segments2).
+        Opcodes are computed on whitespace-free words and index the whitespace-preserving segments.
+        """
+        words1, segments1 = cls._split_word_segments(text1)
+        words2, segments2 = cls._split_word_segments(text2)
+
+        if _RapidfuzzLevenshtein is not None:
+            opcodes = [(op.tag, op.src_start, op.src_end, op.dest_start, op.dest_end)
+                       for op in _RapidfuzzLevenshtein.opcodes(words1, words2)]
+            return opcodes, segments1, segments2
 
         word_matcher = difflib.SequenceMatcher(None, words1, words2, autojunk=False)
-        modified_content_html = ""
+        return word_matcher.get_opcodes(), segments1, segments2
 
-        for tag, i1, i2, j1, j2 in word_matcher.get_opcodes():
+    @classmethod
+    def _get_block_diff(cls, block: Dict) -> Tuple[List[Tuple[str, int, int, int, int]], List[str], List[str]]:
+        """Returns the word diff of a modified block, computing and caching it on the block on first use."""
+        if "_diff" not in block:
+            block["_diff"] = cls._diff_modified_block(block.get("text1", ""), block.get("text2", ""))
+        return block["_diff"]
 
-            text1_segment = "".join(words1[i1:i2])
-            text2_segment = "".join(words2[j1:j2])
+    @classmethod
+    def _render_word_diff_html(cls, text1: str, text2: str,
+                               diff: Optional[Tuple[List[Tuple[str, int, int, int, int]], List[str], List[str]]] = None) -> str:
+        """Performs word-level diff and renders HTML with specific styling."""
+        opcodes, segments1, segments2 = diff if diff is not None else cls._diff_modified_block(text1, text2)
+        html_parts: List[str] = []
+
+        for tag, i1, i2, j1, j2 in opcodes:
+
+            text1_segment = "".join(segments1[i1:i2])
+            text2_segment = "".join(segments2[j1:j2])
 
             escaped1 = html.escape(text1_segment)
             escaped2 = html.escape(text2_segment)
@@ -315,36 +759,83 @@ class GroqPDFComparator:
 
 
             if tag == 'equal':
-                modified_content_html += f"<span class='llm-word status-equal'>{escaped2}</span>"
+                html_parts.append(f"<span class='llm-word status-equal'>{escaped2}</span>")
 
             elif tag == 'delete':
                 if escaped1.strip() and escaped1 != '<br>\n':
-                    modified_content_html += f"<span class='llm-word status-deleted'>{escaped1}</span>"
+                    html_parts.append(f"<span class='llm-word status-deleted'>{escaped1}</span>")
 
                 else:
-                    modified_content_html += escaped1
+                    html_parts.append(escaped1)
 
             elif tag == 'insert':
                 if escaped2.strip() and escaped2 != '<br>\n':
-                    modified_content_html += f"<span class='llm-word status-added'>{escaped2}</span>"
+                    html_parts.append(f"<span class='llm-word status-added'>{escaped2}</span>")
 
                 else:
-                    modified_content_html += escaped2
+                    html_parts.append(escaped2)
 
             elif tag == 'replace':
                 if escaped2.strip() and escaped2 != '<br>\n':
-                     modified_content_html += f"<span class='llm-word status-modified'>{escaped2}</span>"
+                     html_parts.append(f"<span class='llm-word status-modified'>{escaped2}</span>")
 
                 elif not escaped1.strip() and escaped2:
-                     modified_content_html += escaped2
+                     html_parts.append(escaped2)
 
                 elif escaped1.strip() and not escaped2.strip():
-                     modified_content_html += f"<span class='llm-word status-deleted'>{escaped1}</span>"
+                     html_parts.append(f"<span class='llm-word status-deleted'>{escaped1}</span>")
 
                 elif escaped1 and escaped2:
-                    modified_content_html += escaped2
+                    html_parts.append(escaped2)
+
+        return "".join(html_parts)
+
+    @classmethod
+    def _local_change_blocks(cls, chunk1: str, chunk2: str) -> Tuple[float, Optional[List[Dict]]]:
+        """
+        Diffs a chunk pair locally when it is near-identical, so it needs no API call.
+
+        Returns:
+            Tuple[float, Optional[List[Dict]]]: (similarity, change blocks), where the blocks
+                                                are None when the pair should go to the API.
+        """
+        total_len = len(chunk1) + len(chunk2)
+        if 2 * min(len(chunk1), len(chunk2)) / total_len <= cls.NEAR_IDENTICAL_THRESHOLD:
+            return 0.0, None
+
+        diff = cls._diff_modified_block(chunk1, chunk2)
+        opcodes, segments1, segments2 = diff
+        matched_chars = sum(len("".join(segments1[i1:i2])) for tag, i1, i2, _, _ in opcodes if tag == 'equal')
+        similarity = 2 * matched_chars / total_len
+        if similarity <= cls.NEAR_IDENTICAL_THRESHOLD:
+            return similarity, None
+
+        status_by_tag = {"equal": "equal", "delete": "deleted", "insert": "added", "replace": "modified"}
+        change_blocks = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                change_blocks.extend(cls._equal_run_blocks(segments1[i1:i2], segments2[j1:j2]))
+                continue
+            change_blocks.append({"status": status_by_tag[tag],
+                                  "text1": "".join(segments1[i1:i2]),
+                                  "text2": "".join(segments2[j1:j2])})
+        return similarity, change_blocks
 
-        return modified_content_html
+    @staticmethod
+    def _equal_run_blocks(segments1: List[str], segments2: List[str]) -> List[Dict]:
+        """
+        Blocks for a run of matching words: equal where the segments are identical, modified where
+        only the whitespace around the words differs, as the API reports such edits.
+        """
+        blocks = []
+        for is_same, pairs in groupby(zip(segments1, segments2), key=lambda pair: pair[0] == pair[1]):
+            pairs = list(pairs)
+            text1 = "".join(segment1 for segment1, _ in pairs)
+            if is_same:
+                blocks.append({"status": "equal", "text1": text1, "text2": text1})
+            else:
+                blocks.append({"status": "modified", "text1": text1, "text2": "".join(segment2 for _, segment2 in pairs)})
+        return blocks
 
     @classmethod
     def _render_change_blocks_html(cls, change_blocks: List[Dict]) -> str:
@@ -371,7 +862,7 @@ class GroqPDFComparator:
                  if text2: block_html = f"<span class='llm-word status-added'>{escaped_text}</span>"
 
             elif status == "modified":
-                block_html = cls._render_word_diff_html(text1, text2)
+                block_html = cls._render_word_diff_html(text1, text2, cls._get_block_diff(block))
 
             if block_html:
                 html_output_parts.append(block_html)
@@ -407,16 +898,13 @@ class GroqPDFComparator:
                 modified_block_count += 1
                 modified_chars_in_new += len(text2)
 
-                words1 = re.split(r'(\s+)', text1); words1 = [w for w in words1 if w]
-                words2 = re.split(r'(\s+)', text2); words2 = [w for w in words2 if w]
-
-                word_matcher = difflib.SequenceMatcher(None, words1, words2, autojunk=False)
+                opcodes, segments1, segments2 = self._get_block_diff(block)
                 mod_added_net = 0
                 mod_deleted_net = 0
 
-                for tag, i1, i2, j1, j2 in word_matcher.get_opcodes():
-                     seg1 = "".join(words1[i1:i2])
-                     seg2 = "".join(words2[j1:j2])
+                for tag, i1, i2, j1, j2 in opcodes:
+                     seg1 = "".join(segments1[i1:i2])
+                     seg2 = "".join(segments2[j1:j2])
                      if tag == 'insert':
                          mod_added_net += len(seg2)
 
@@ -438,9 +926,50 @@ class GroqPDFComparator:
         }
 
 
+    def _group_pairs_for_batching(self, pairs: List[Tuple[int, str, str]]) -> List[List[Tuple[int, str, str]]]:
+        """Groups consecutive chunk pairs greedily so each request stays within the batch token budget."""
+        # Chunks from _chunk_text_by_tokens already have their token counts recorded; only others are encoded.
+        token_counts = self._chunk_token_counts
+        unknown_texts = list({text for _, chunk1, chunk2 in pairs for text in (chunk1, chunk2)
+                              if text not in token_counts})
+        if unknown_texts:
+            encodings = self.tokenizer.encode_ordinary_batch(unknown_texts, num_threads=os.cpu_count() or 1)
+            token_counts.update(zip(unknown_texts, map(len, encodings)))
+
+        # Leave room in small context windows for the instructions and the restated answer.
+        context_window = self.MODEL_CONTEXT_WINDOWS.get(self.model_name, self.DEFAULT_CONTEXT_WINDOW)
+        token_budget = min(self.BATCH_TOKEN_BUDGET, context_window // 3)
+
+        batches: List[List[Tuple[int, str, str]]] = []
+        current_batch: List[Tuple[int, str, str]] = []
+        current_tokens = 0
+        for pair in pairs:
+            pair_tokens = token_counts[pair[1]] + token_counts[pair[2]]
+            if current_batch and current_tokens + pair_tokens > token_budget:
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            current_batch.append(pair)
+            current_tokens += pair_tokens
+
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+
     def compare(self) -> bool:
         """
         Main comparison logic: extract, chunk, call API, render.
+        Runs the asynchronous pipeline to completion on a fresh event loop.
+
+        Returns:
+            bool: True if comparison process completed (check self.success for actual outcome),
+                  False if a critical error stopped the process early.
+        """
+        return asyncio.run(self._acompare())
+
+    async def _acompare(self) -> bool:
+        """
+        Asynchronous comparison pipeline; non-trivial chunk pairs are sent to the API concurrently.
 
         Returns:
             bool: True if comparison process completed (check self.success for actual outcome),
@@ -452,7 +981,9 @@ class GroqPDFComparator:
         self.all_change_blocks = []
         self.rendered_html = None
         self.summary = self._get_default_summary()
-        self.debug_logs = []
+        self.debug_logs = deque(maxlen=self.MAX_DEBUG_LOG_ENTRIES)
+        self._debug_log_count = 0
+        self._chunk_token_counts = {}
         self.api_call_counter = 0
         self.text1_raw = None
         self.text2_raw = None
@@ -488,17 +1019,23 @@ class GroqPDFComparator:
                  self.success = True
                  return self.success
 
+            prefix_text, middle1, middle2, suffix_text = self._split_common_paragraphs(self.text1_raw, self.text2_raw)
+            prefix_blocks = [{"status": "equal", "text1": prefix_text, "text2": prefix_text}] if prefix_text else []
+            suffix_blocks = [{"status": "equal", "text1": suffix_text, "text2": suffix_text}] if suffix_text else []
+            if prefix_text or suffix_text:
+                print(f"Unchanged leading/trailing paragraphs: {len(prefix_text)} + {len(suffix_text)} chars kept as equal blocks")
+
             print("Chunking text...")
             try:
-                chunks1 = self._chunk_text_by_tokens(self.text1_raw)
-                chunks2 = self._chunk_text_by_tokens(self.text2_raw)
+                chunks1 = self._chunk_text_by_tokens(middle1)
+                chunks2 = self._chunk_text_by_tokens(middle2)
                 print(f"Chunked Doc1: {len(chunks1)} chunks, Doc2: {len(chunks2)} chunks")
 
             except Exception as e:
                 self.error_message = f"Error during text chunking: {e}"
                 return False
 
-            if not chunks1 and not chunks2:
+            if not chunks1 and not chunks2 and not (prefix_blocks or suffix_blocks):
                 print("Both documents produced no chunks after processing.")
                 self.success = True
                 return True
@@ -506,43 +1043,94 @@ class GroqPDFComparator:
             num_chunks_to_process = max(len(chunks1), len(chunks2))
             print(f"Processing {num_chunks_to_process} chunk pairs...")
             self.all_change_blocks = []
+            blocks_per_chunk: List[Optional[List[Dict]]] = [None] * num_chunks_to_process
+            api_chunk_pairs: List[Tuple[int, str, str]] = []
 
             for i in range(num_chunks_to_process):
-                print(f"Processing chunk pair {i+1}/{num_chunks_to_process}...")
                 chunk1 = chunks1[i] if i < len(chunks1) else ""
                 chunk2 = chunks2[i] if i < len(chunks2) else ""
 
                 if not chunk1.strip() and not chunk2.strip():
                     print(f"  Skipping empty chunk pair {i+1}")
+                    blocks_per_chunk[i] = []
                     continue
 
                 if not chunk1.strip() and chunk2.strip(): # Chunk added
                     print(f"  Chunk {i+1}: Added block (no API call)")
-                    self.all_change_blocks.append({"status": "added", "text1": "", "text2": chunk2})
+                    blocks_per_chunk[i] = [{"status": "added", "text1": "", "text2": chunk2}]
                     continue
 
                 if chunk1.strip() and not chunk2.strip(): # Chunk deleted
                     print(f"  Chunk {i+1}: Deleted block (no API call)")
-                    self.all_change_blocks.append({"status": "deleted", "text1": chunk1, "text2": ""})
+                    blocks_per_chunk[i] = [{"status": "deleted", "text1": chunk1, "text2": ""}]
                     continue
 
                 if chunk1 == chunk2:
                     print(f"  Chunk {i+1}: Equal block (no API call)")
-                    self.all_change_blocks.append({"status": "equal", "text1": chunk1, "text2": chunk2})
+                    blocks_per_chunk[i] = [{"status": "equal", "text1": chunk1, "text2": chunk1}]
                     continue
 
-                if self.api_call_counter > 0:
-                    time.sleep(0.1)
-
-                change_blocks_result = self._call_groq_change_blocks(chunk1, chunk2)
+                similarity, local_blocks = self._local_change_blocks(chunk1, chunk2)
+                if local_blocks is not None:
+                    print(f"  Chunk {i+1}: Near-identical ({similarity:.3f}), {len(local_blocks)} blocks diffed locally (no API call)")
+                    blocks_per_chunk[i] = local_blocks
+                    continue
 
-                if change_blocks_result is None:
-                    print(f"  API Call for chunk {i+1} failed. Error: {self.error_message}")
-                    self.success = False
-                    return self.success
+                cached_blocks = self._get_cached_blocks(chunk1, chunk2)
+                if cached_blocks is not None:
+                    print(f"  Chunk {i+1}: Cached result, {len(cached_blocks)} blocks (no API call)")
+                    blocks_per_chunk[i] = cached_blocks
+                    continue
 
-                self.all_change_blocks.extend(change_blocks_result)
-                print(f"  Chunk {i+1}: Processed via API, {len(change_blocks_result)} blocks found.")
+                api_chunk_pairs.append((i, chunk1, chunk2))
+
+            if api_chunk_pairs:
+                batches = self._group_pairs_for_batching(api_chunk_pairs)
+                print(f"Sending {len(api_chunk_pairs)} chunk pairs to the API in {len(batches)} requests "
+                      f"(max {self.max_concurrent_requests} concurrent)...")
+                semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+                self._rate_limiter = AsyncRateLimiter(self.requests_per_minute, self.tokens_per_minute)
+
+                async def call_with_limit(chunk1: str, chunk2: str) -> Optional[List[Dict]]:
+                    async with semaphore:
+                        return await self._acall_groq_change_blocks(chunk1, chunk2)
+
+                async def call_batch(batch: List[Tuple[int, str, str]]) -> List[Optional[List[Dict]]]:
+                    if len(batch) > 1:
+                        async with semaphore:
+                            batch_results = await self._acall_groq_change_blocks_batch(
+                                [(chunk1, chunk2) for _, chunk1, chunk2 in batch]
+                            )
+                        if batch_results is not None:
+                            return batch_results
+                    return await asyncio.gather(*(call_with_limit(chunk1, chunk2) for _, chunk1, chunk2 in batch))
+
+                # The async client's connection pool is bound to this event loop, so a client we
+                # create here is closed before asyncio.run() tears the loop down.
+                owns_async_client = self.async_groq_client is None
+                if owns_async_client:
+                    self.async_groq_client = AsyncGroq(api_key=self.groq_client.api_key)
+                try:
+                    batch_results = await asyncio.gather(*(call_batch(batch) for batch in batches))
+                finally:
+                    if owns_async_client:
+                        await self.async_groq_client.close()
+                        self.async_groq_client = None
+
+                # Batches are consecutive runs of api_chunk_pairs, so flattening keeps chunk order.
+                api_results = [result for results in batch_results for result in results]
+                for (i, _, _), change_blocks_result in zip(api_chunk_pairs, api_results):
+                    if change_blocks_result is None:
+                        print(f"  API Call for chunk {i+1} failed. Error: {self.error_message}")
+                        self.success = False
+                        return self.success
+                    blocks_per_chunk[i] = change_blocks_result
+                    print(f"  Chunk {i+1}: Processed via API, {len(change_blocks_result)} blocks found.")
+
+            self.all_change_blocks.extend(prefix_blocks)
+            for chunk_blocks in blocks_per_chunk:
+                self.all_change_blocks.extend(chunk_blocks)
+            self.all_change_blocks.extend(suffix_blocks)
 
             print("Finished processing all chunks.")
 
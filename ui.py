@@ -1,10 +1,15 @@
 import streamlit as st
+import streamlit.components.v1 as components
+import functools
+import hashlib
+import importlib.util
+import json
+import re
 import time
 import os
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
-from groq import Groq
-from typing import Optional, Any
-from utils import BaseComparator
+from typing import Optional, Any, Dict, List, Tuple
 try:
     from utils import extract_text_from_file
     utils_available = True
@@ -13,75 +18,191 @@ except ImportError:
     st.error("Core utility 'utils.py' not found. App cannot function.", icon="🚨")
     st.stop()
 
-PDFComparator = BaseComparator
-GroqPDFComparator = BaseComparator
-basic_comparator_available = False
-llm_comparator_available = False
-
-
 try:
-    from comparator import PDFComparator as BasicComp
-    if hasattr(BasicComp, '_generate_word_diff_html') and callable(getattr(BasicComp, 'compare')):
-        PDFComparator = BasicComp
-        basic_comparator_available = True
-        print("Enhanced Basic comparator loaded successfully.")
-    else:
-         print("Basic comparator module found but lacks expected enhancements or 'compare' method.")
-         basic_comparator_available = False
-         st.warning("Basic comparator ('comparator.py') found but seems outdated or invalid.", icon="⚠️")
-
-except ImportError as e:
-    basic_comparator_available = False
-    st.warning(f"Basic comparator ('comparator.py') not found: {e}", icon="⚠️")
-    print(f"Basic comparator not found: {e}")
-
-try:
-    from llm_comparator import GroqPDFComparator as LLMComp
-    if hasattr(LLMComp, 'compare') and callable(getattr(LLMComp, 'compare')):
-        GroqPDFComparator = LLMComp
-        llm_comparator_available = True
-        print("LLM comparator loaded successfully.")
-    else:
-         print("LLM comparator module found but lacks 'compare' method.")
-         llm_comparator_available = False
-         st.warning("LLM comparator ('llm_comparator.py') found but seems invalid.", icon="⚠️")
-
-except ImportError as e:
-    llm_comparator_available = False
-    st.warning(f"LLM comparator ('llm_comparator.py') not found or dependency error: {e}.", icon="⚠️")
-    print(f"LLM comparator not found or error: {e}")
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# The comparator modules pull in heavy dependencies (groq/httpx, tiktoken), so only their presence is
+# checked here; they are imported the first time a comparison actually runs.
+# kind -> (module, comparator class, other modules it needs, module attributes it must provide)
+COMPARATOR_SPECS = {
+    "basic": ("comparator", "PDFComparator", (), ("_generate_word_diff_html",)),
+    "llm": ("llm_comparator", "GroqPDFComparator", ("groq",), ()),
+}
+comparator_available = {
+    kind: all(importlib.util.find_spec(name) is not None for name in (module_name, *dependencies))
+    for kind, (module_name, _, dependencies, _) in COMPARATOR_SPECS.items()
+}
+basic_comparator_available = comparator_available["basic"]
+llm_comparator_available = comparator_available["llm"]
+
+
+@functools.lru_cache(maxsize=None)
+def load_comparator(kind: str):
+    """Imports and validates a comparator class; raises ImportError if it or a dependency is missing or outdated."""
+    module_name, class_name, _, required_attributes = COMPARATOR_SPECS[kind]
+    module = importlib.import_module(module_name)
+    comparator_class = getattr(module, class_name, None)
+    if not (callable(getattr(comparator_class, 'compare', None))
+            and all(hasattr(module, attribute) for attribute in required_attributes)):
+        raise ImportError(f"Comparator '{module_name}.py' found but seems outdated or invalid.")
+    print(f"{kind.capitalize()} comparator loaded successfully.")
+    return comparator_class
+
+
+@functools.lru_cache(maxsize=1)
+def load_groq_client_class():
+    """Imports the Groq client class on first use."""
+    from groq import Groq
+    return Groq
 
 
 st.set_page_config(layout="wide", page_title="DocuDiff", page_icon="📄")
 load_dotenv()
 
-GROQ_API_KEY = ""
-api_key_source_msg = "API Key Status: <span style='color: red;'>Missing</span>"
 
-def update_key_status():
-    global GROQ_API_KEY, api_key_source_msg
-    env_key = os.environ.get("GROQ_API_KEY", "")
+@st.cache_resource(show_spinner=False)
+def get_groq_client(api_key: str):
+    """One Groq client (and HTTP connection pool) per API key, reused across reruns."""
+    return load_groq_client_class()(api_key=api_key)
+
+
+# Comparator attributes the results section reads; cached results keep only these.
+RESULT_FIELDS = ("success", "error_message", "is_identical", "is_identical_raw", "text1_raw", "text2_raw",
+                 "diff_html", "rendered_html", "summary", "all_change_blocks", "debug_logs", "api_call_counter")
+
+
+class UncachedComparisonResult(Exception):
+    """Carries a failed comparison's result out of a cached runner, since st.cache_data never caches exceptions."""
+    def __init__(self, result: dict):
+        super().__init__(result.get("error_message"))
+        self.result = result
+
+
+def file_digest(uploaded_file) -> str:
+    """Content hash of an uploaded file, used as its cache key; xxh3 when available, else BLAKE2b."""
+    with uploaded_file.getbuffer() as file_view:
+        if xxhash is not None:
+            return xxhash.xxh3_128_hexdigest(file_view)
+        return hashlib.blake2b(file_view, digest_size=16).hexdigest()
+
+
+def api_key_digest(api_key: str) -> str:
+    """BLAKE2b digest of an API key, so cached LLM results are keyed per key without hashing the key itself."""
+    return hashlib.blake2b(api_key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def comparison_result_view(comparator_instance) -> dict:
+    """Plain, picklable copy of the result attributes; raises UncachedComparisonResult for failed runs."""
+    result = {field: getattr(comparator_instance, field) for field in RESULT_FIELDS if hasattr(comparator_instance, field)}
+    if "debug_logs" in result:
+        result["debug_logs"] = list(result["debug_logs"])
+    if "all_change_blocks" in result:
+        result["all_change_blocks"] = [{key: value for key, value in block.items() if key != "_diff"}
+                                       for block in result["all_change_blocks"]]
+    if not result.get("success"):
+        raise UncachedComparisonResult(result)
+    return result
+
+
+@dataclass(frozen=True)
+class ResultView:
+    """Snapshot of a comparison result as the results panel reads it; absent fields keep their defaults."""
+    success: bool = False
+    error_message: Optional[str] = None
+    is_identical: bool = False
+    is_identical_raw: bool = False
+    text1_raw: Optional[str] = None
+    text2_raw: Optional[str] = None
+    diff_html: Optional[str] = None
+    rendered_html: Optional[str] = None
+    summary: Dict[str, int] = field(default_factory=dict)
+    all_change_blocks: List[Dict[str, Any]] = field(default_factory=list)
+    debug_logs: List[Tuple[int, str, str]] = field(default_factory=list)
+    api_call_counter: int = 0
+    text1_bytes: bytes = b''
+    text2_bytes: bytes = b''
+    diff_document: str = ""
+    rendered_document: str = ""
+    debug_entries: Optional[List[Tuple[int, str, str, str]]] = None
+
+
+def _log_language(response: Any) -> str:
+    """Code-block language for a logged response: JSON only for successful responses that look like JSON."""
+    if not isinstance(response, str) or response.lstrip()[:1] not in ('{', '['):
+        return 'text'
+    return 'json' if 'Success' in response else 'text'
+
+
+def format_debug_logs(debug_logs: List[Any]) -> Optional[List[Tuple[int, str, str, str]]]:
+    """
+    (number, prompt, response, language) entries for the debug tab, or None if the logs are not
+    (number, prompt, response) triples.
+    """
+    if not all(isinstance(item, (list, tuple)) and len(item) == 3 for item in debug_logs):
+        return None
+    return [(number, prompt, response, _log_language(response)) for number, prompt, response in debug_logs]
+
+
+def result_view(result: dict) -> ResultView:
+    """Session-state form of a result, with the downloads, diff views and debug entries built once up front."""
+    return ResultView(**result,
+                      text1_bytes=(result.get("text1_raw") or "").encode('utf-8'),
+                      text2_bytes=(result.get("text2_raw") or "").encode('utf-8'),
+                      diff_document=virtual_diff_document(result["diff_html"]) if result.get("diff_html") else "",
+                      rendered_document=(f"<div class='diff-llm-container'>{result['rendered_html']}</div>"
+                                         if result.get("rendered_html") else ""),
+                      debug_entries=format_debug_logs(result.get("debug_logs") or []))
+
+
+# Arguments with a leading underscore are not hashed; the digests and options form the cache key.
+@st.cache_data(show_spinner=False, max_entries=16, ttl=3600)
+def run_basic_comparison(file1_digest: str, file2_digest: str, _file_1, _file_2,
+                         options: Tuple[Tuple[str, bool], ...]) -> dict:
+    comparator_instance = load_comparator("basic")(_file_1, _file_2, **dict(options))
+    comparator_instance.compare()
+    return comparison_result_view(comparator_instance)
+
+
+@st.cache_data(show_spinner=False, max_entries=16, ttl=3600)
+def run_llm_comparison(file1_digest: str, file2_digest: str, key_digest: str, _file_1, _file_2, _api_key: str,
+                       model_name: str, max_chunk_tokens: int) -> dict:
+    comparator_instance = load_comparator("llm")(_file_1, _file_2, get_groq_client(_api_key),
+                                                model_name, max_chunk_tokens)
+    comparator_instance.compare()
+    return comparison_result_view(comparator_instance)
+
+
+GROQ_MODELS: Tuple[str, ...] = (
+    "gemma2-9b-it","llama-3.3-70b-versatile","llama-3.1-8b-instant","llama3-70b-8192","llama3-8b-8192",
+    "meta-llama/llama-4-scout-17b-16e-instruct","meta-llama/llama-4-maverick-17b-128e-instruct",
+    "qwen-2.5-32b","deepseek-r1-distill-qwen-32b","deepseek-r1-distill-llama-70b"
+)
+DEFAULT_MODEL = "llama3-70b-8192"
+DEFAULT_MODEL_INDEX = GROQ_MODELS.index(DEFAULT_MODEL) if DEFAULT_MODEL in GROQ_MODELS else 0
+
+_KEY_STATUS_HTML = "API Key Status: <span style='color: {color};'>{text}</span>"
+
+
+@st.cache_resource(show_spinner=False)
+def _env_groq_key() -> str:
+    """GROQ_API_KEY from the environment (after load_dotenv), read once per process."""
+    return os.environ.get("GROQ_API_KEY", "")
+
+
+def current_key() -> Tuple[str, str]:
+    """Returns (api_key, status_html); an environment key takes precedence over one entered this session."""
+    env_key = _env_groq_key()
+    if env_key:
+        return env_key, _KEY_STATUS_HTML.format(color="green", text="Loaded from Environment")
     session_key = st.session_state.get('groq_api_key', "")
+    if session_key:
+        return session_key, _KEY_STATUS_HTML.format(color="blue", text="Using provided key")
+    return "", _KEY_STATUS_HTML.format(color="red", text="Missing")
 
-    if env_key:
-        GROQ_API_KEY = env_key
-        st.session_state['groq_api_key'] = GROQ_API_KEY
-        status_text = "Loaded from Environment"
-        status_color = "green"
-    elif session_key:
-        GROQ_API_KEY = session_key
-        status_text = "Using provided key"
-        status_color = "blue"
-    else:
-        GROQ_API_KEY = ""
-        status_text = "Missing"
-        status_color = "red"
-    api_key_source_msg = f"API Key Status: <span style='color: {status_color};'>{status_text}</span>"
-
-update_key_status()
-
-
-st.markdown("""
+
+APP_CSS = """
 <style>
     /* Base Styles */
     .main { padding: 1rem 2rem; }
@@ -139,7 +260,74 @@ st.markdown("""
     .diff-llm-container-inner { white-space: pre-wrap; color: #000; }
 
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+@st.cache_data(show_spinner=False)
+def _css() -> str:
+    """APP_CSS with comments and indentation stripped, built once per process instead of per rerun."""
+    css = re.sub(r"/\*.*?\*/", "", APP_CSS, flags=re.DOTALL)
+    return re.sub(r"\s+", " ", css).strip()
+
+
+BASIC_DIFF_LEGEND_HTML = """
+<div class='legend'>
+    <span class='diff-added'><span class='diff-marker'>+</span>Added Line</span>
+    <span class='diff-deleted'><span class='diff-marker'>-</span>Deleted Line</span>
+    <span class='diff-modified'><span class='diff-marker'>*</span>Modified Line</span>
+    <span class='diff-equal'><span class='diff-marker'> </span>Unchanged Line</span>
+    <span class='word-added' style='padding: 1px 3px;'>Added Word</span>
+    <span class='word-deleted' style='padding: 1px 3px;'>Deleted Word</span>
+    <small>Word diff shown within modified (*) lines. Preprocessing options affect comparison.</small>
+</div> <hr>
+"""
+
+LLM_DIFF_LEGEND_HTML = """
+<div class='legend-llm'>
+    <span class='status-added'>Added Text</span>
+    <span class='status-deleted'>Deleted Text</span>
+    <span class='status-modified'>Modified Text</span>
+    <span class='status-equal'>Unchanged Text</span>
+    <small>Word-level diff within modified blocks. Unchanged text has no background highlight.</small>
+</div> <hr>
+"""
+
+
+# Rows of the basic diff are mounted in batches as the inner container scrolls, so long documents do not
+# put every line into the DOM at once.
+DIFF_VIEW_HEIGHT = 650
+DIFF_ROWS_PER_BATCH = 200
+
+_VIRTUAL_DIFF_TEMPLATE = """<!DOCTYPE html>
+<html><head>{css}<style>body {{ margin: 0; }} .diff-container {{ height: 100vh; max-height: none; box-sizing: border-box; }}</style></head>
+<body><div class='diff-container' id='diff-rows'><div id='diff-sentinel'></div></div>
+<script>
+const rows = {rows};
+const container = document.getElementById('diff-rows');
+const sentinel = document.getElementById('diff-sentinel');
+let mounted = 0;
+const observer = new IntersectionObserver(entries => {{
+    if (entries.some(entry => entry.isIntersecting)) mountBatch();
+}}, {{ root: container, rootMargin: '400px' }});
+function mountBatch() {{
+    const end = Math.min(mounted + {batch}, rows.length);
+    sentinel.insertAdjacentHTML('beforebegin', rows.slice(mounted, end).join('\\n'));
+    mounted = end;
+    if (mounted >= rows.length) observer.disconnect();
+}}
+observer.observe(sentinel);
+</script></body></html>"""
+
+
+def virtual_diff_document(diff_html: str) -> str:
+    """Standalone page for components.html that mounts the diff's lines (one per newline) lazily."""
+    rows = json.dumps(diff_html.split('\n')).replace("</", "<\\/")
+    return _VIRTUAL_DIFF_TEMPLATE.format(css=_css(), rows=rows, batch=DIFF_ROWS_PER_BATCH)
+
+
+# Streamlit drops elements a rerun does not emit again, so the (small, minified) stylesheet is sent on
+# every run rather than only once per session.
+st.markdown(_css(), unsafe_allow_html=True)
 
 st.title("📄 DocuDiff: PDF & Text Comparison")
 st.markdown("Compare document versions using standard `difflib` (with word-level diff) or advanced Groq LLM analysis.")
@@ -160,29 +348,22 @@ with st.sidebar:
         if not llm_comparator_available:
             st.warning("LLM Comparator module not loaded.", icon="⚠️")
         else:
-            if not GROQ_API_KEY:
+            groq_api_key, api_key_status = current_key()
+            if not groq_api_key:
                 with st.form("api_key_form"):
                     key_input = st.text_input("Enter Groq API Key:", type="password", key="groq_api_key_input_sidebar", help="Required for LLM.")
                     submitted = st.form_submit_button("Save Key")
                     if submitted and key_input:
                         st.session_state['groq_api_key'] = key_input
-                        update_key_status()
                         st.success("API Key saved for this session!")
                         st.rerun()
                     elif submitted:
                         st.warning("Please enter an API key.")
-            st.markdown(api_key_source_msg, unsafe_allow_html=True)
-            if GROQ_API_KEY and "provided key" in api_key_source_msg:
+            st.markdown(api_key_status, unsafe_allow_html=True)
+            if groq_api_key and "provided key" in api_key_status:
                 st.caption("Key stored temporarily in session state.")
 
-            GROQ_MODELS = [
-                "gemma2-9b-it","llama-3.3-70b-versatile","llama-3.1-8b-instant","llama3-70b-8192","llama3-8b-8192",
-                "meta-llama/llama-4-scout-17b-16e-instruct","meta-llama/llama-4-maverick-17b-128e-instruct",
-                "qwen-2.5-32b","deepseek-r1-distill-qwen-32b","deepseek-r1-distill-llama-70b"
-            ]
-            DEFAULT_MODEL = "llama3-70b-8192"
-            default_index = GROQ_MODELS.index(DEFAULT_MODEL) if DEFAULT_MODEL in GROQ_MODELS else 0
-            selected_model = st.selectbox("Choose Groq Model:", GROQ_MODELS, index=default_index,
+            selected_model = st.selectbox("Choose Groq Model:", GROQ_MODELS, index=DEFAULT_MODEL_INDEX,
                                           key="selected_groq_model", help="Select LLM model.",
                                           disabled=not llm_comparator_available)
 
@@ -228,7 +409,8 @@ with st.container(border=True):
 st.divider()
 button_col1, button_col2 = st.columns(2)
 files_ready = file_1 and file_2
-llm_ready = files_ready and llm_comparator_available and bool(GROQ_API_KEY)
+groq_api_key = current_key()[0]
+llm_ready = files_ready and llm_comparator_available and bool(groq_api_key)
 
 with button_col1:
     basic_compare_button = st.button("📊 Compare Basic (`difflib`)",
@@ -240,7 +422,7 @@ with button_col2:
                                    use_container_width=True,
                                    disabled=not llm_ready, type="primary")
 
-    if files_ready and llm_comparator_available and not GROQ_API_KEY:
+    if files_ready and llm_comparator_available and not groq_api_key:
         st.warning("Groq API Key needed in sidebar for LLM comparison.", icon="🔑")
 
 if 'last_comparison_result' not in st.session_state: st.session_state.last_comparison_result = None
@@ -261,21 +443,19 @@ if basic_compare_button and not st.session_state.comparison_running:
                 "ignore_punctuation": st.session_state.get("basic_ignore_punctuation", False),
                 "de_hyphenate": st.session_state.get("basic_dehyphenate", True)
             }
-            comparator_instance = PDFComparator(file_1, file_2, **options)
-            process_finished = comparator_instance.compare()
-            st.session_state.last_comparison_result = comparator_instance
+            result = run_basic_comparison(file_digest(file_1), file_digest(file_2), file_1, file_2,
+                                          tuple(sorted(options.items())))
+            st.session_state.last_comparison_result = result_view(result)
+        except UncachedComparisonResult as failed:
+            st.session_state.last_comparison_result = result_view(failed.result)
         except Exception as e:
             st.error(f"Error during basic comparison execution: {e}")
-            error_result = BaseComparator()
-            error_result.success = False
-            error_result.error_message = f"Execution Error: {e}"
-            st.session_state.last_comparison_result = error_result
+            st.session_state.last_comparison_result = ResultView(error_message=f"Execution Error: {e}")
     st.session_state.comparison_running = False
-    st.rerun()
 
 elif llm_compare_button and not st.session_state.comparison_running:
     if not llm_comparator_available: st.error("LLM Comparator module not loaded or failed to load correctly."); st.stop()
-    if not GROQ_API_KEY: st.error("Groq API Key missing. Please provide it in the sidebar."); st.stop()
+    if not groq_api_key: st.error("Groq API Key missing. Please provide it in the sidebar."); st.stop()
 
     st.session_state.comparison_running = True
     st.session_state.last_method = "llm"; st.session_state.last_comparison_result = None
@@ -283,186 +463,175 @@ elif llm_compare_button and not st.session_state.comparison_running:
     current_max_tokens = st.session_state.max_chunk_tokens
 
     try:
-        client = Groq(api_key=GROQ_API_KEY)
-        llm_comparator_instance = GroqPDFComparator(file_1, file_2, client,
-                                                    current_selected_model, current_max_tokens)
-
         with st.spinner(f"Comparing using LLM ({current_selected_model})... This may take time."):
             start_comp_time = time.time()
-            process_finished = llm_comparator_instance.compare()
+            try:
+                result = run_llm_comparison(file_digest(file_1), file_digest(file_2), api_key_digest(groq_api_key),
+                                            file_1, file_2, groq_api_key, current_selected_model, current_max_tokens)
+            except UncachedComparisonResult as failed:
+                result = failed.result
             end_comp_time = time.time()
             st.session_state.comparison_time = end_comp_time - start_comp_time
-            st.session_state.last_comparison_result = llm_comparator_instance
+            st.session_state.last_comparison_result = result_view(result)
 
     except Exception as e:
         st.error(f"Failed to initialize or run LLM comparison: {e}")
-        error_result = BaseComparator()
-        error_result.success = False
-        error_result.error_message = f"Initialization/Run Error: {e}"
-        st.session_state.last_comparison_result = error_result
+        st.session_state.last_comparison_result = ResultView(error_message=f"Initialization/Run Error: {e}")
 
     st.session_state.comparison_running = False
-    st.rerun()
 
 st.divider()
 st.subheader("📊 Comparison Results")
 
-comparator_result = st.session_state.get('last_comparison_result')
-method_used = st.session_state.get('last_method')
+def render_basic_view(result: ResultView):
+    st.markdown(BASIC_DIFF_LEGEND_HTML, unsafe_allow_html=True)
+    components.html(result.diff_document, height=DIFF_VIEW_HEIGHT, scrolling=False)
 
-if comparator_result:
-    info_message = f"Displaying results from **{method_used.upper()}** comparison."
-    if method_used == 'llm' and hasattr(st.session_state, 'comparison_time'):
-        info_message += f" (Completed in {st.session_state.comparison_time:.2f}s)"
-    is_success = getattr(comparator_result, 'success', False)
-    st.info(info_message, icon="✅" if is_success else "❌")
 
-    if not is_success:
-        err_msg = getattr(comparator_result, 'error_message', 'An unknown error occurred during comparison.')
-        st.error(f"Comparison Failed: {err_msg}")
+def render_llm_view(result: ResultView):
+    if not result.rendered_document: # LLM ran successfully, but no rendered_html
+        st.warning("LLM comparison view could not be rendered (potentially due to rendering error after successful API calls). Check debug logs.")
+        return
+    st.markdown(LLM_DIFF_LEGEND_HTML, unsafe_allow_html=True)
+    st.markdown(result.rendered_document, unsafe_allow_html=True)
 
-    elif getattr(comparator_result, 'is_identical_raw', False):
-        st.success("✅ Documents are identical (based on raw text extraction).")
 
-    elif getattr(comparator_result, 'is_identical', False): # Covers basic & potentially LLM if it sets this
-        st.success("✅ Documents are identical (after preprocessing/analysis).")
+# Comparison View tab renderer per method; each reads only its own result fields.
+DIFF_VIEW_RENDERERS = {"basic": render_basic_view, "llm": render_llm_view}
 
-    elif method_used == 'llm' and is_success and not getattr(comparator_result, 'all_change_blocks', True):
-         st.success("✅ LLM analysis completed successfully and found no differences.")
 
-    elif is_success:
-        has_basic_diff = method_used == 'basic' and getattr(comparator_result, 'diff_html', None)
-        has_llm_rendered_diff = method_used == 'llm' and getattr(comparator_result, 'rendered_html', None)
-        llm_found_blocks = method_used == 'llm' and getattr(comparator_result, 'all_change_blocks', [])
+@st.fragment
+def render_results(file1_name: str, file2_name: str):
+    """Results panel; tab switches and download clicks rerun only this fragment, not the whole app."""
+    comparator_result = st.session_state.get('last_comparison_result')
+    method_used = st.session_state.get('last_method')
 
-        if not (has_basic_diff or has_llm_rendered_diff):
-            if method_used == 'llm' and llm_found_blocks:
-                 st.warning("LLM found differences, but failed to render the comparison view. Check Debug logs.")
+    if comparator_result:
+        info_message = f"Displaying results from **{method_used.upper()}** comparison."
+        if method_used == 'llm' and hasattr(st.session_state, 'comparison_time'):
+            info_message += f" (Completed in {st.session_state.comparison_time:.2f}s)"
+        is_success = comparator_result.success
+        st.info(info_message, icon="✅" if is_success else "❌")
+
+        if not is_success:
+            err_msg = comparator_result.error_message or 'An unknown error occurred during comparison.'
+            st.error(f"Comparison Failed: {err_msg}")
+
+        elif comparator_result.is_identical_raw:
+            st.success("✅ Documents are identical (based on raw text extraction).")
+
+        elif comparator_result.is_identical: # Covers basic & potentially LLM if it sets this
+            st.success("✅ Documents are identical (after preprocessing/analysis).")
+
+        elif method_used == 'llm' and is_success and not comparator_result.all_change_blocks:
+             st.success("✅ LLM analysis completed successfully and found no differences.")
+
+        elif is_success:
+            has_basic_diff = method_used == 'basic' and comparator_result.diff_html
+            has_llm_rendered_diff = method_used == 'llm' and comparator_result.rendered_html
+            llm_found_blocks = method_used == 'llm' and comparator_result.all_change_blocks
+
+            if not (has_basic_diff or has_llm_rendered_diff):
+                if method_used == 'llm' and llm_found_blocks:
+                     st.warning("LLM found differences, but failed to render the comparison view. Check Debug logs.")
+                else:
+                     st.warning("Comparison complete, but no visual differences were generated (may indicate only whitespace changes or minor differences ignored by preprocessing).")
+                if comparator_result.error_message:
+                     st.warning(f"Details: {comparator_result.error_message}")
             else:
-                 st.warning("Comparison complete, but no visual differences were generated (may indicate only whitespace changes or minor differences ignored by preprocessing).")
-            if hasattr(comparator_result, 'error_message') and comparator_result.error_message:
-                 st.warning(f"Details: {comparator_result.error_message}")
+                tab_titles = ["📈 Summary", "↔️ Comparison View", "📄 Extracted Text"]
+                if method_used == 'llm':
+                     tab_titles.append("🐞 LLM Debug")
+
+                summary_tab, view_tab, text_tab, *debug_tab_list = st.tabs(tab_titles)
+
+                with summary_tab:
+                    summary = comparator_result.summary
+                    if not summary and is_success and not comparator_result.is_identical:
+                         st.warning("Summary data is unexpectedly empty despite reported differences.")
+                    elif method_used == 'basic':
+                        st.subheader("Basic Diff Summary (Line-based)")
+                        add_count = summary.get('lines_added', 0)
+                        del_count = summary.get('lines_deleted', 0)
+                        mod_count = summary.get('lines_modified', 0)
+                        if add_count == 0 and del_count == 0 and mod_count == 0 and not comparator_result.is_identical:
+                             st.info("Summary shows no line changes based on diff opcodes. Differences might be within lines (word-level only) or whitespace.")
+                        sum_cols = st.columns(3)
+                        with sum_cols[0]: st.metric("Lines Added (+)", f"{add_count}")
+                        with sum_cols[1]: st.metric("Lines Deleted (-)", f"{del_count}")
+                        with sum_cols[2]: st.metric("Lines Modified (*)", f"{mod_count}") # Changed label
+                        if mod_count > 0: st.caption("Modified lines contain word-level differences highlighted below.")
+                    elif method_used == 'llm':
+                        st.subheader("LLM Diff Summary (Net Change & Block based)")
+                        sum_cols = st.columns(4)
+                        with sum_cols[0]: st.metric("Net Chars Added", f"➕ {summary.get('added_chars', 0):,}")
+                        with sum_cols[1]: st.metric("Net Chars Deleted", f"➖ {summary.get('deleted_chars', 0):,}")
+                        with sum_cols[2]: st.metric("Modified Blocks", f"🔄 {summary.get('modified_blocks', 0):,}")
+                        with sum_cols[3]: st.metric("Modified Chars (New)", f"🎨 {summary.get('modified_chars', 0):,}")
+                        st.caption("Character counts reflect net changes. 'Modified Chars (New)' counts chars in the 'new' text of modified blocks.")
+
+                with view_tab:
+                    st.subheader("Detailed Differences")
+                    DIFF_VIEW_RENDERERS[method_used](comparator_result)
+
+
+                with text_tab:
+                    st.subheader("Raw Extracted Text (Before Preprocessing)")
+                    txt_col1, txt_col2 = st.columns(2)
+                    text1_val = comparator_result.text1_raw or "(Empty)"
+                    text2_val = comparator_result.text2_raw or "(Empty)"
+
+                    with txt_col1:
+                        st.text_area(f"Document 1: {file1_name}", text1_val, height=400, key="text1_area_main", help="Raw text extracted from Document 1.")
+                        st.download_button(
+                            label="📥 Download Text 1",
+                            data=comparator_result.text1_bytes,
+                            file_name=f"{os.path.splitext(file1_name)[0]}_extracted.txt",
+                            mime="text/plain"
+                        )
+                    with txt_col2:
+                        st.text_area(f"Document 2: {file2_name}", text2_val, height=400, key="text2_area_main", help="Raw text extracted from Document 2.")
+                        st.download_button(
+                            label="📥 Download Text 2",
+                            data=comparator_result.text2_bytes,
+                            file_name=f"{os.path.splitext(file2_name)[0]}_extracted.txt",
+                            mime="text/plain"
+                        )
+
+                if debug_tab_list:
+                    with debug_tab_list[0]:
+                        st.subheader("LLM API Call Logs & Debug Info")
+                        debug_logs = comparator_result.debug_logs
+                        if debug_logs:
+                             log_count = comparator_result.api_call_counter or len(debug_logs) # Use counter if available
+                             st.info(f"Displaying logs for {log_count} API call(s) attempted.")
+                             # Entries are validated and their languages detected once, in result_view()
+                             if comparator_result.debug_entries is not None:
+                                 for number, prompt, response_or_error, lang in comparator_result.debug_entries:
+                                     st.markdown(f"--- **Call {number}** ---")
+                                     with st.expander(f"Prompt {number}", expanded=False):
+                                         st.code(prompt, language='text')
+                                     st.text("Response / Status:")
+                                     st.code(response_or_error, language=lang)
+                             else:
+                                  st.error("Debug logs are not in the expected format (list of numbered entries).")
+                                  st.json(debug_logs)
+
+                        elif not is_success:
+                            st.warning(f"Comparison failed, no specific debug logs recorded. Error: {comparator_result.error_message}")
+                        elif is_success:
+                            st.info("No debug logs recorded (comparison might have succeeded without API calls or logging failed).")
+                        else:
+                             st.info("No debug logs available for this comparison.")
+
+        elif not is_success:
+             pass
         else:
-            tab_titles = ["📈 Summary", "↔️ Comparison View", "📄 Extracted Text"]
-            if method_used == 'llm':
-                 tab_titles.append("🐞 LLM Debug")
-
-            summary_tab, view_tab, text_tab, *debug_tab_list = st.tabs(tab_titles)
-
-            with summary_tab:
-                summary = getattr(comparator_result, 'summary', {})
-                if not summary and is_success and not getattr(comparator_result, 'is_identical', False):
-                     st.warning("Summary data is unexpectedly empty despite reported differences.")
-                elif method_used == 'basic':
-                    st.subheader("Basic Diff Summary (Line-based)")
-                    add_count = summary.get('lines_added', 0)
-                    del_count = summary.get('lines_deleted', 0)
-                    mod_count = summary.get('lines_modified', 0)
-                    if add_count == 0 and del_count == 0 and mod_count == 0 and not getattr(comparator_result, 'is_identical', False):
-                         st.info("Summary shows no line changes based on diff opcodes. Differences might be within lines (word-level only) or whitespace.")
-                    sum_cols = st.columns(3)
-                    with sum_cols[0]: st.metric("Lines Added (+)", f"{add_count}")
-                    with sum_cols[1]: st.metric("Lines Deleted (-)", f"{del_count}")
-                    with sum_cols[2]: st.metric("Lines Modified (*)", f"{mod_count}") # Changed label
-                    if mod_count > 0: st.caption("Modified lines contain word-level differences highlighted below.")
-                elif method_used == 'llm':
-                    st.subheader("LLM Diff Summary (Net Change & Block based)")
-                    sum_cols = st.columns(4)
-                    with sum_cols[0]: st.metric("Net Chars Added", f"➕ {summary.get('added_chars', 0):,}")
-                    with sum_cols[1]: st.metric("Net Chars Deleted", f"➖ {summary.get('deleted_chars', 0):,}")
-                    with sum_cols[2]: st.metric("Modified Blocks", f"🔄 {summary.get('modified_blocks', 0):,}")
-                    with sum_cols[3]: st.metric("Modified Chars (New)", f"🎨 {summary.get('modified_chars', 0):,}")
-                    st.caption("Character counts reflect net changes. 'Modified Chars (New)' counts chars in the 'new' text of modified blocks.")
-
-            with view_tab:
-                st.subheader("Detailed Differences")
-                if method_used == 'basic' and has_basic_diff:
-                    st.markdown(f"""
-                    <div class='legend'>
-                        <span class='diff-added'><span class='diff-marker'>+</span>Added Line</span>
-                        <span class='diff-deleted'><span class='diff-marker'>-</span>Deleted Line</span>
-                        <span class='diff-modified'><span class='diff-marker'>*</span>Modified Line</span>
-                        <span class='diff-equal'><span class='diff-marker'> </span>Unchanged Line</span>
-                        <span class='word-added' style='padding: 1px 3px;'>Added Word</span>
-                        <span class='word-deleted' style='padding: 1px 3px;'>Deleted Word</span>
-                        <small>Word diff shown within modified (*) lines. Preprocessing options affect comparison.</small>
-                    </div> <hr>
-                    """, unsafe_allow_html=True)
-                    st.markdown(f"<div class='diff-container'>{comparator_result.diff_html}</div>", unsafe_allow_html=True)
-
-                elif method_used == 'llm' and has_llm_rendered_diff:
-                    st.markdown(f"""
-                    <div class='legend-llm'>
-                        <span class='status-added'>Added Text</span>
-                        <span class='status-deleted'>Deleted Text</span>
-                        <span class='status-modified'>Modified Text</span>
-                        <span class='status-equal'>Unchanged Text</span>
-                        <small>Word-level diff within modified blocks. Unchanged text has no background highlight.</small>
-                    </div> <hr>
-                    """, unsafe_allow_html=True)
-                    st.markdown(f"<div class='diff-llm-container'>{comparator_result.rendered_html}</div>", unsafe_allow_html=True)
-                elif method_used == 'llm' and is_success: # LLM ran successfully, but no rendered_html
-                     st.warning("LLM comparison view could not be rendered (potentially due to rendering error after successful API calls). Check debug logs.")
-
-
-            with text_tab:
-                st.subheader("Raw Extracted Text (Before Preprocessing)")
-                txt_col1, txt_col2 = st.columns(2)
-                text1_val = getattr(comparator_result, 'text1_raw', "N/A") or "(Empty)"
-                text2_val = getattr(comparator_result, 'text2_raw', "N/A") or "(Empty)"
-                file1_name = getattr(file_1, 'name', 'doc1') if file_1 else 'doc1'
-                file2_name = getattr(file_2, 'name', 'doc2') if file_2 else 'doc2'
-
-                with txt_col1:
-                    st.text_area(f"Document 1: {file1_name}", text1_val, height=400, key="text1_area_main", help="Raw text extracted from Document 1.")
-                    st.download_button(
-                        label="📥 Download Text 1",
-                        data=text1_val.encode('utf-8') if text1_val != "(Empty)" else b'',
-                        file_name=f"{os.path.splitext(file1_name)[0]}_extracted.txt",
-                        mime="text/plain"
-                    )
-                with txt_col2:
-                    st.text_area(f"Document 2: {file2_name}", text2_val, height=400, key="text2_area_main", help="Raw text extracted from Document 2.")
-                    st.download_button(
-                        label="📥 Download Text 2",
-                        data=text2_val.encode('utf-8') if text2_val != "(Empty)" else b'',
-                        file_name=f"{os.path.splitext(file2_name)[0]}_extracted.txt",
-                        mime="text/plain"
-                    )
-
-            if debug_tab_list:
-                with debug_tab_list[0]:
-                    st.subheader("LLM API Call Logs & Debug Info")
-                    debug_logs = getattr(comparator_result, 'debug_logs', [])
-                    if debug_logs:
-                         log_count = getattr(comparator_result, 'api_call_counter', len(debug_logs)) # Use counter if available
-                         st.info(f"Displaying logs for {log_count} API call(s) attempted.")
-                         # Ensure logs is a list of tuples/lists with 2 elements
-                         if isinstance(debug_logs, list) and all(isinstance(item, (list, tuple)) and len(item) == 2 for item in debug_logs):
-                             for i, log_entry in enumerate(debug_logs):
-                                 prompt, response_or_error = log_entry
-                                 st.markdown(f"--- **Call {i + 1}** ---")
-                                 with st.expander(f"Prompt {i+1}", expanded=False):
-                                     st.code(prompt, language='text')
-                                 st.text("Response / Status:")
-                                 is_json_like = isinstance(response_or_error, str) and (response_or_error.strip().startswith('{') or response_or_error.strip().startswith('['))
-                                 lang = 'json' if 'Success' in str(response_or_error) and is_json_like else 'text'
-                                 st.code(response_or_error, language=lang)
-                         else:
-                              st.error("Debug logs are not in the expected format (list of pairs).")
-                              st.json(debug_logs)
-
-                    elif not is_success and hasattr(comparator_result, 'error_message'):
-                        st.warning(f"Comparison failed, no specific debug logs recorded. Error: {comparator_result.error_message}")
-                    elif is_success:
-                        st.info("No debug logs recorded (comparison might have succeeded without API calls or logging failed).")
-                    else:
-                         st.info("No debug logs available for this comparison.")
-
-    elif not is_success and hasattr(comparator_result, 'error_message'):
-         pass
-    else:
-        st.warning("Could not display comparison results due to an unexpected state or missing data.")
-
-elif not st.session_state.comparison_running:
-    st.info("⬆️ Upload two documents (PDF or TXT) in the section above and click a comparison button.")
\ No newline at end of file
+            st.warning("Could not display comparison results due to an unexpected state or missing data.")
+
+    elif not st.session_state.comparison_running:
+        st.info("⬆️ Upload two documents (PDF or TXT) in the section above and click a comparison button.")
+
+
+render_results(getattr(file_1, 'name', 'doc1') if file_1 else 'doc1',
+               getattr(file_2, 'name', 'doc2') if file_2 else 'doc2')
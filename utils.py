@@ -1,11 +1,276 @@
+import codecs
 import fitz
+import hashlib
+import logging
+import multiprocessing
+import os
 import re
-from io import BytesIO
-from typing import Optional
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from io import BytesIO, StringIO
+from itertools import repeat
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    from charset_normalizer import from_bytes as _detect_charset
+except ImportError:
+    _detect_charset = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+# pypdfium2 extracts PDF text instead of PyMuPDF only when this variable is set to "pypdfium2"; installing it
+# alone changes nothing. The choice is read once per process, so both sides of a comparison use the same engine.
+PDF_ENGINE_ENV = "DOCUDIFF_PDF_ENGINE"
+
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+# PyMuPDF's plain-text defaults, pinned so no optional post-processing (dehyphenation, image or span
+# extras) runs: whitespace, ligatures, media-box clipping and the raw code of glyphs lacking a Unicode mapping.
+_PDF_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT
+# PyMuPDF documents cannot be shared between threads, so long PDFs are split into page ranges that
+# worker processes open independently; below this many pages the process start-up costs more than it saves.
+# Workers are spawned rather than forked, since forking Streamlit's multithreaded server can deadlock.
+_PARALLEL_PAGE_THRESHOLD = 200
+_MAX_EXTRACTION_WORKERS = 8
+# Byte-order marks checked before any decoding is attempted; the utf-16/utf-32 codecs read the byte order from
+# the BOM. The UTF-32 LE mark starts with the UTF-16 LE one, so the UTF-32 marks are tried first.
+_TEXT_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+_LINE_BREAK_RE = re.compile(r'\r\n?')
+# Content sniffing: a PDF starts with its %PDF- header; an upload without a .txt or .pdf extension is
+# treated as text when its first 1 KiB holds only bytes from this set (NUL and most control characters mark binary).
+_HEADER_PEEK_SIZE = 1024
+_PDF_MAGIC = b'%PDF-'
+_TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f})
+# Lower-cased fragments of PyMuPDF and pypdfium2 error messages and the message shown for each; first match wins.
+_PDF_ERROR_MESSAGES = (
+    ("cannot open broken document", "Corrupted or invalid PDF."),
+    ("data format error", "Corrupted or invalid PDF."),
+    ("password", "Password-protected PDF (not supported)."),
+    ("unsupported security scheme", "Password-protected PDF (not supported)."),
+)
+# pypdfium2 refuses a document without pages with "Failed to load document (PDFium: Success)".
+_EMPTY_PDF_FRAGMENTS = ("no objects found", "is empty", "(pdfium: success)")
+# Extraction results keyed by (content digest, file name), so the same upload is only parsed once per process.
+_EXTRACTION_CACHE_SIZE = 16
+_HASH_CHUNK_SIZE = 4 * 1024 * 1024
+_extraction_cache: "OrderedDict[Tuple[bytes, str], Tuple[str, None]]" = OrderedDict()
+_extraction_cache_lock = threading.Lock()
+# Uploads above MAX_UPLOAD_BYTES (the app's maxUploadSize) are rejected before they are hashed or parsed.
+# PDFs above _SPILL_TO_DISK_BYTES are copied to a temporary file so MuPDF reads them from disk
+# rather than through a second in-memory copy.
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+_SPILL_TO_DISK_BYTES = 32 * 1024 * 1024
+
+def _clean_extracted_text(text: str) -> str:
+    """Collapses runs of blank lines into one and strips trailing spaces from every line."""
+    text = _BLANK_LINES_RE.sub('\n\n', text)
+    if ' \n' in text:
+        text = '\n'.join([line.rstrip(' ') for line in text.split('\n')])
+    return text
+
+def _decode_text(file_bytes: bytes) -> Tuple[str, str]:
+    """
+    Decodes TXT content as (text, encoding): BOM first, then UTF-8, then charset detection or Latin-1.
+    CRLF and CR line breaks come back as LF; they are normalised on the decoded text, because in UTF-16 and
+    UTF-32 (with or without a BOM) a 0x0D byte may be part of any character.
+    """
+    text = None
+    encoding = next((codec for bom, codec in _TEXT_BOMS if file_bytes.startswith(bom)), None)
+    if encoding is not None:
+        text = file_bytes.decode(encoding)
+    elif file_bytes.isascii():
+        # ASCII is valid UTF-8; checking for it first skips the UTF-8 decoder's validation for the common case.
+        text, encoding = file_bytes.decode('ascii'), 'utf-8'
+    else:
+        try:
+            text, encoding = file_bytes.decode('utf-8'), 'utf-8'
+        except UnicodeDecodeError:
+            if _detect_charset is not None:
+                best_match = _detect_charset(file_bytes).best()
+                if best_match is not None:
+                    text, encoding = str(best_match), best_match.encoding
+    if text is None:
+        text, encoding = file_bytes.decode('latin-1'), 'latin-1'
+    if '\r' in text:
+        text = _LINE_BREAK_RE.sub('\n', text)
+    return text, encoding
+
+def _peek_head(uploaded_file) -> bytes:
+    """First _HEADER_PEEK_SIZE bytes of the file, leaving the read position at the start."""
+    uploaded_file.seek(0)
+    head = uploaded_file.read(_HEADER_PEEK_SIZE)
+    uploaded_file.seek(0)
+    return head
+
+def _looks_like_text(head: bytes) -> bool:
+    """True for a non-empty header that has a text BOM or only text bytes."""
+    if not head:
+        return False
+    return head.startswith(tuple(bom for bom, _ in _TEXT_BOMS)) or not head.translate(None, _TEXT_BYTES)
+
+def _upload_size(uploaded_file) -> int:
+    """Size of the file in bytes, leaving the read position at the start."""
+    if isinstance(uploaded_file, BytesIO):
+        with uploaded_file.getbuffer() as file_view:
+            return file_view.nbytes
+    size = uploaded_file.seek(0, os.SEEK_END)
+    uploaded_file.seek(0)
+    return size
+
+@contextmanager
+def _open_pdf(uploaded_file):
+    """
+    Opens the upload with PyMuPDF and yields (document, path). Small in-memory uploads are opened through a
+    view of their buffer, so the content is not copied; large ones are spilled to a temporary file, whose
+    path is yielded and which is removed on exit.
+    """
+    if _upload_size(uploaded_file) <= _SPILL_TO_DISK_BYTES:
+        with ExitStack() as stack:
+            if isinstance(uploaded_file, BytesIO):
+                stream = stack.enter_context(uploaded_file.getbuffer())
+            else:
+                uploaded_file.seek(0)
+                stream = uploaded_file.read()
+            document = stack.enter_context(fitz.open(stream=stream, filetype="pdf"))
+            yield document, None
+        return
+
+    with _spill_to_disk(uploaded_file) as pdf_path, fitz.open(pdf_path, filetype="pdf") as document:
+        yield document, pdf_path
+
+@contextmanager
+def _spill_to_disk(uploaded_file):
+    """Copies the upload to a temporary PDF file and yields its path; the file is removed on exit."""
+    spill = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+    try:
+        with spill:
+            uploaded_file.seek(0)
+            shutil.copyfileobj(uploaded_file, spill, _HASH_CHUNK_SIZE)
+        yield spill.name
+    finally:
+        os.unlink(spill.name)
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Worker for parallel extraction: opens its own copy of the document from disk and returns the pages' text."""
+    with fitz.open(pdf_path, filetype="pdf") as document:
+        return [document[page_number].get_text("text", flags=_PDF_TEXT_FLAGS) for page_number in range(start, stop)]
+
+def _iter_page_texts(document, uploaded_file, pdf_path: Optional[str] = None) -> Iterable[str]:
+    """
+    Text of every page in order, extracted in worker processes for long documents. The workers always read the
+    document from a file (the spilled copy, or one written here), so the content is never pickled to them.
+    """
+    page_count = document.page_count
+    workers = min(os.cpu_count() or 1, _MAX_EXTRACTION_WORKERS)
+    if page_count < _PARALLEL_PAGE_THRESHOLD or workers < 2 or document.needs_pass:
+        return (page.get_text("text", flags=_PDF_TEXT_FLAGS) for page in document)
+
+    step = -(-page_count // workers)
+    starts = range(0, page_count, step)
+    stops = [min(start + step, page_count) for start in starts]
+    try:
+        with ExitStack() as stack:
+            if pdf_path is None:
+                pdf_path = stack.enter_context(_spill_to_disk(uploaded_file))
+            executor = stack.enter_context(
+                ProcessPoolExecutor(max_workers=len(starts), mp_context=multiprocessing.get_context("spawn")))
+            ranges = list(executor.map(_extract_page_range, repeat(pdf_path), starts, stops))
+    except Exception as pool_e:
+        logger.warning("Parallel PDF extraction failed (%s); extracting pages serially.", pool_e)
+        return (page.get_text("text", flags=_PDF_TEXT_FLAGS) for page in document)
+    return (text for page_texts in ranges for text in page_texts)
+
+@lru_cache(maxsize=1)
+def _use_pdfium() -> bool:
+    """True if PDF_ENGINE_ENV selects pypdfium2 and it is installed; read on first use, after the app loads .env."""
+    if os.environ.get(PDF_ENGINE_ENV, "").strip().lower() != "pypdfium2":
+        return False
+    if pdfium is None:
+        logger.warning("%s selects pypdfium2, which is not installed; extracting PDF text with PyMuPDF.", PDF_ENGINE_ENV)
+        return False
+    return True
+
+def _iter_pdfium_page_texts(uploaded_file) -> Iterable[str]:
+    """
+    Text of every page in order via pypdfium2, with its CRLF line breaks turned into LF. PDFium reads the upload
+    through the file object as it needs blocks, so the content is not copied; encryption is reported on open.
+    """
+    uploaded_file.seek(0)
+    pdf = pdfium.PdfDocument(uploaded_file)
+    try:
+        for page in pdf:
+            textpage = page.get_textpage()
+            try:
+                yield textpage.get_text_range().replace('\r\n', '\n')
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+
+def _join_page_texts(page_texts: Iterable[str]) -> str:
+    """Non-empty pages joined by newlines as they are extracted, without the document's outer whitespace."""
+    buf = StringIO()
+    write = buf.write
+    started = False
+    # Whitespace after the last text written so far; only emitted once more text follows it.
+    pending = ''
+    for page_text in page_texts:
+        if not page_text:
+            continue
+        body = page_text.rstrip()
+        tail = page_text[len(body):] + '\n'
+        if not body:
+            if started: pending += tail
+            continue
+        if started:
+            write(pending)
+        else:
+            body = body.lstrip()
+            started = True
+        write(body)
+        pending = tail
+    return buf.getvalue()
+
+def _extract_pdf_text(uploaded_file) -> str:
+    """
+    Text of the whole document from the process's one PDF engine. A pypdfium2 failure is reported as an error
+    rather than retried with PyMuPDF, which would leave the two sides of a comparison on different engines.
+    """
+    if _use_pdfium():
+        return _join_page_texts(_iter_pdfium_page_texts(uploaded_file))
+    with _open_pdf(uploaded_file) as (document, pdf_path):
+        return _join_page_texts(_iter_page_texts(document, uploaded_file, pdf_path))
+
+def _content_digest(uploaded_file) -> bytes:
+    """BLAKE2b digest of the file's content, hashed in place for in-memory uploads."""
+    if isinstance(uploaded_file, BytesIO):
+        with uploaded_file.getbuffer() as file_view:
+            return hashlib.blake2b(file_view, digest_size=16).digest()
+    hasher = hashlib.blake2b(digest_size=16)
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(_HASH_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.digest()
 
 def extract_text_from_file(uploaded_file):
     """
     Extracts text from an uploaded file (PDF or TXT).
+    Successful results are cached by file content and name, so repeated calls skip re-parsing.
 
     Args:
         uploaded_file: The uploaded file object from Streamlit.
@@ -17,81 +282,72 @@ def extract_text_from_file(uploaded_file):
         return None, "Internal error: No file object provided."
 
     file_name = getattr(uploaded_file, 'name', 'unknown')
+    try:
+        file_size = _upload_size(uploaded_file)
+    except Exception:
+        file_size = None
+    if file_size is not None and file_size > MAX_UPLOAD_BYTES:
+        return None, (f"'{file_name}' is too large ({file_size / (1024 * 1024):.0f} MB); "
+                      f"the limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+
+    try:
+        cache_key = (_content_digest(uploaded_file), file_name)
+    except Exception:
+        return _extract_text(uploaded_file, file_name)
+
+    with _extraction_cache_lock:
+        cached = _extraction_cache.get(cache_key)
+        if cached is not None:
+            _extraction_cache.move_to_end(cache_key)
+            return cached
+
+    result = _extract_text(uploaded_file, file_name)
+    if result[1] is None:
+        with _extraction_cache_lock:
+            _extraction_cache[cache_key] = result
+            if len(_extraction_cache) > _EXTRACTION_CACHE_SIZE:
+                _extraction_cache.popitem(last=False)
+    return result
+
+def _extract_text(uploaded_file, file_name: str):
+    """Uncached extraction behind extract_text_from_file; same (text, error) contract."""
     file_ext = file_name.lower().split('.')[-1] if '.' in file_name else ''
     error_message = None
     full_text = None
 
     try:
-        file_bytes = uploaded_file.getvalue()
+        # An explicit .txt is always decoded as text; otherwise the %PDF- header or a .pdf extension picks PDF.
+        head = _peek_head(uploaded_file)
+        if file_ext != "txt" and (head.startswith(_PDF_MAGIC) or file_ext == "pdf"):
+            try:
+                full_text = _clean_extracted_text(_extract_pdf_text(uploaded_file))
+            except Exception as pdf_e:
+                pdf_error = str(pdf_e).lower()
+                error_message = next((message for fragment, message in _PDF_ERROR_MESSAGES if fragment in pdf_error), None)
+                if error_message is None:
+                    if any(fragment in pdf_error for fragment in _EMPTY_PDF_FRAGMENTS): full_text = ""
+                    else: error_message = f"PDF processing error: {pdf_e}"
 
-        if file_ext == "txt":
+        elif file_ext == "txt" or _looks_like_text(head):
+            file_bytes = uploaded_file.getvalue()
             try:
-                full_text = file_bytes.decode('utf-8')
+                full_text, encoding = _decode_text(file_bytes)
             except UnicodeDecodeError:
-                try:
-                    full_text = file_bytes.decode('latin-1')
-                    print(f"Warning: Decoded '{file_name}' as latin-1.")
-                except UnicodeDecodeError:
-                     return None, "Text encoding error (not UTF-8 or Latin-1)."
-            full_text = full_text.replace('\r\n', '\n').replace('\r', '\n')
-
-        elif file_ext == "pdf":
-            try:
-                document = fitz.open(stream=file_bytes, filetype="pdf")
-                page_texts = [page.get_text("text") for page in document]
-                document.close()
-                full_text = "\n".join(filter(None, page_texts))
-                full_text = re.sub(r'\n\s*\n+', '\n\n', full_text)
-                full_text = re.sub(r' +\n', '\n', full_text)
-            except Exception as pdf_e:
-                if "cannot open broken document" in str(pdf_e): error_message = "Corrupted or invalid PDF."
-                elif "password" in str(pdf_e).lower(): error_message = "Password-protected PDF (not supported)."
-                elif "No objects found" in str(pdf_e) or "is empty" in str(pdf_e): full_text = ""
-                else: error_message = f"PDF processing error: {pdf_e}"
+                 return None, "Text encoding error (the file's byte-order mark does not match its content)."
+            if encoding not in ('utf-8', 'utf-8-sig', 'utf-16', 'utf-32'):
+                print(f"Warning: Decoded '{file_name}' as {encoding}.")
+            full_text = full_text.strip()
+
         else:
-            try:
-                print(f"Attempting PDF extraction for unknown type: {file_ext}")
-                document = fitz.open(stream=file_bytes, filetype="pdf")
-                page_texts = [page.get_text("text") for page in document]
-                document.close()
-                full_text = "\n".join(filter(None, page_texts))
-                full_text = re.sub(r'\n\s*\n+', '\n\n', full_text)
-                full_text = re.sub(r' +\n', '\n', full_text)
-                if not full_text.strip():
-                     error_message = f"Unsupported file type: '{file_ext}'. Please upload PDF or TXT."
-                     full_text = None
-            except Exception:
-                 error_message = f"Unsupported file type: '{file_ext}'. Please upload PDF or TXT."
+            error_message = f"Unsupported file type: '{file_ext}'. Please upload PDF or TXT."
 
 
+        # PDF text comes out of _join_page_texts already trimmed and TXT text is stripped above.
         if full_text is not None:
-            return full_text.strip(), None
+            return full_text, None
         else:
             final_error = error_message or f"Could not extract text from '{file_name}'."
             return None, final_error
 
     except Exception as e:
         return None, f"Error processing '{file_name}': {type(e).__name__} - {e}"
-
-
-class BaseComparator:
-    success: bool = False
-    error_message: Optional[str] = "Comparator module not loaded."
-    is_identical: bool = False
-    is_identical_raw: bool = False
-    text1_raw: Optional[str] = None
-    text2_raw: Optional[str] = None
-    diff_html: Optional[str] = None
-    rendered_html: Optional[str] = None
-    summary: dict = {}
-    all_change_blocks: list = []
-    debug_logs: list = []
-    api_call_counter: int = 0
-
-    def __init__(self, *args, **kwargs):
-        pass
-
-    def compare(self) -> bool:
-        print(f"WARN: Called compare() on BaseComparator placeholder for {type(self).__name__}")
-        self.success = False
-        return False
\ No newline at end of file